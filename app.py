@@ -1,13 +1,22 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from markupsafe import Markup, escape
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify, stream_with_context
 from auth import register_user, verify_user, update_user_profile
-from database import get_user_chats, get_chat_messages, create_new_chat, add_message_to_chat
-from chat_handler import process_query
+from password_hashing import HashingBusy
+from upstream import Deadline
+from database import (get_user, get_user_chats, get_user_chats_page, get_chat_messages_page,
+                      create_new_chat, add_chat_turn, check_schema, search_messages,
+                      HIGHLIGHT_START, HIGHLIGHT_END)
+from chat_handler import available_sources, process_queries, process_query, process_query_stream
+from metrics import render as render_metrics, stage, track_request
 import os
+import json
 from dotenv import load_dotenv
+from config import Config
 from datetime import datetime
 from constants import LANGUAGES, LEARNING_STYLES, TONE_PRESETS, PREDEFINED_PERSONAS
 
 load_dotenv()
+check_schema()  # migrations are applied with `python database.py migrate`, not on import
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'default-secret-key')
@@ -45,6 +54,13 @@ def login():
             flash('Invalid username or password', 'danger')
     return render_template('login.html')
 
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    """Reject sign-ins quickly while the password hashing pool is saturated."""
+    flash('Too many people are signing in right now. Please try again in a moment.', 'danger')
+    template = 'register.html' if request.endpoint == 'register' else 'login.html'
+    return render_template(template), 503, {'Retry-After': '2'}
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -60,16 +76,12 @@ def register():
 
 @app.route('/profile', methods=['GET'])
 def profile():
-    from database import get_db_connection
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    user_id = session['user_id']
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM Users WHERE user_id = ?', (user_id,)).fetchone()
-    conn.close()
+    user = get_user(session['user_id'])
     
-    return render_template('profile.html', user=dict(user), LANGUAGES=LANGUAGES,
+    return render_template('profile.html', user=user, LANGUAGES=LANGUAGES,
                          TONE_PRESETS=TONE_PRESETS,
                          PREDEFINED_PERSONAS=PREDEFINED_PERSONAS,
                          LEARNING_STYLES=LEARNING_STYLES)
@@ -94,6 +106,35 @@ def update_profile():
     return redirect(url_for('profile'))
 
 
+def wants_stream() -> bool:
+    return (request.form.get('stream') == '1'
+            or 'text/event-stream' in request.headers.get('Accept', ''))
+
+def stream_reply(user_id, message, chat_id, sources=None, deadline=None):
+    """Yield the reply as Server-Sent Events, persisting the turn once the stream ends or is cancelled."""
+    with track_request('stream', user_id=user_id, chat_id=chat_id):
+        parts = []
+        tokens = process_query_stream(user_id, message, chat_id, sources, deadline)
+        try:
+            for token in tokens:
+                parts.append(token)
+                yield f"data: {json.dumps({'token': token})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception:
+            app.logger.exception("Streaming reply failed")
+            yield f"event: error\ndata: {json.dumps({'error': 'Sorry, an error occurred. Please try again.'})}\n\n"
+        finally:
+            tokens.close()
+            with stage('persist'):
+                add_chat_turn(chat_id, user_id, message, "".join(parts))
+
+
+def unknown_sources(sources):
+    """Names in sources that match no indexed guide."""
+    known = set(available_sources())
+    return [source for source in sources if source not in known]
+
+
 @app.route('/chat', methods=['GET', 'POST'])
 def chat():
     if 'user_id' not in session:
@@ -107,36 +148,147 @@ def chat():
             return redirect(url_for('chat', chat_id=chat_id))
         chat_id = request.form.get('chat_id')
         message = request.form.get('message')
+        sources = [source for source in request.form.getlist('source') if source]
+        unknown = unknown_sources(sources)
+        if unknown:
+            return jsonify({'error': f'Unknown sources: {", ".join(unknown)}'}), 400
+        deadline = Deadline.for_request()
         
         if message and chat_id:
-            add_message_to_chat(chat_id, user_id, 'user', message)
-            ai_response = process_query(user_id, message, chat_id)
-            add_message_to_chat(chat_id, user_id, 'assistant', ai_response)
+            if wants_stream():
+                return Response(
+                    stream_with_context(stream_reply(user_id, message, chat_id, sources, deadline)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+                )
+            with track_request('blocking', user_id=user_id, chat_id=chat_id):
+                try:
+                    ai_response = process_query(user_id, message, chat_id, sources, deadline)
+                except Exception:
+                    add_chat_turn(chat_id, user_id, message, None)
+                    raise
+                with stage('persist'):
+                    add_chat_turn(chat_id, user_id, message, ai_response)
             
             return jsonify({'response': ai_response})
     
-    chat_id = request.args.get('chat_id')
+    chat_id = request.args.get('chat_id', type=int)
+    chats, more_chats = get_user_chats_page(user_id, limit=Config.CHAT_LIST_PAGE_SIZE)
     if not chat_id:
-        chats = get_user_chats(user_id)
-        chat_id = chats[0]['chat_id'] if chats else create_new_chat(user_id)
+        if chats:
+            chat_id = chats[0]['chat_id']
+        else:
+            chat_id = create_new_chat(user_id)
+            chats, more_chats = get_user_chats_page(user_id, limit=Config.CHAT_LIST_PAGE_SIZE)
     
-    messages = get_chat_messages(chat_id)
-    chats = get_user_chats(user_id)
+    messages, older_before_id = get_chat_messages_page(chat_id, user_id, limit=Config.MESSAGE_PAGE_SIZE)
     
     return render_template('chat.html', 
                          messages=messages, 
                          chats=chats, 
+                         more_chats=more_chats is not None,
+                         older_before_id=older_before_id,
                          current_chat_id=chat_id,
+                         sources=available_sources(),
                          username=session['username'])
 
+@app.route('/chat/<int:chat_id>/messages')
+def chat_messages(chat_id):
+    """Older messages of a chat for the "load older" button."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    messages, older_before_id = get_chat_messages_page(
+        chat_id, session['user_id'],
+        before_id=request.args.get('before_id', type=int),
+        limit=Config.MESSAGE_PAGE_SIZE
+    )
+    for message in messages:
+        message['timestamp'] = datetimeformat(message['timestamp'])
+    return jsonify({'messages': messages, 'before_id': older_before_id})
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """Answer a JSON list of messages, streaming one JSON result per line as each completes.
+
+    Body: {"messages": ["...", ...], "concurrency": 8, "sources": ["guide.pdf"]}.
+    "sources" is optional and limits retrieval to those guides. Replies are not
+    saved to chat history; results carry each message's position as "index".
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    payload = request.get_json(silent=True) or {}
+    messages = payload.get('messages')
+    if not isinstance(messages, list) or not all(isinstance(m, str) and m.strip() for m in messages):
+        return jsonify({'error': '"messages" must be a list of non-empty strings'}), 400
+    if len(messages) > Config.BATCH_MAX_QUERIES:
+        return jsonify({'error': f'At most {Config.BATCH_MAX_QUERIES} messages per batch'}), 400
+    concurrency = payload.get('concurrency')
+    if concurrency is not None and (not isinstance(concurrency, int) or concurrency < 1):
+        return jsonify({'error': '"concurrency" must be a positive integer'}), 400
+    sources = payload.get('sources')
+    if sources is not None and (not isinstance(sources, list) or not all(isinstance(s, str) for s in sources)):
+        return jsonify({'error': '"sources" must be a list of source names'}), 400
+    unknown = unknown_sources(sources or [])
+    if unknown:
+        return jsonify({'error': f'Unknown sources: {", ".join(unknown)}'}), 400
+    
+    results = process_queries(session['user_id'], messages, concurrency, sources)
+    return Response(
+        stream_with_context(json.dumps(result) + "\n" for result in results),
+        mimetype='application/x-ndjson',
+        headers={'X-Accel-Buffering': 'no'}
+    )
+
+def highlight(snippet: str) -> Markup:
+    """Escape a search snippet and mark its matched terms."""
+    return Markup(str(escape(snippet)).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
+
+def find_messages(user_id: int):
+    """Run the search in the request's q/offset arguments; returns (query, results, next_offset)."""
+    query = request.args.get('q', '').strip()
+    offset = max(0, request.args.get('offset', 0, type=int))
+    if not query:
+        return query, [], None
+    results, next_offset = search_messages(user_id, query, offset=offset, limit=Config.HISTORY_SEARCH_PAGE_SIZE)
+    for result in results:
+        result['snippet'] = highlight(result['snippet'])
+    return query, results, next_offset
+
 @app.route('/history')
 def history():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
     user_id = session['user_id']
-    chats = get_user_chats(user_id)
-    return render_template('history.html', chats=chats)
+    query, results, next_offset = find_messages(user_id)
+    chats = [] if query else get_user_chats(user_id)
+    return render_template('history.html', chats=chats, query=query, results=results, next_offset=next_offset)
+
+@app.route('/history/search')
+def history_search():
+    """Search the user's messages: ?q=words&offset=N, ranked by relevance.
+
+    Returns {"results": [...], "next_offset": N or null}; each snippet is HTML
+    with matched terms in <mark>.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    _, results, next_offset = find_messages(session['user_id'])
+    for result in results:
+        result['snippet'] = str(result['snippet'])
+        result['url'] = url_for('chat', chat_id=result['chat_id'])
+    return jsonify({'results': results, 'next_offset': next_offset})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint, aggregated across gunicorn workers."""
+    if not Config.METRICS_ENABLED:
+        return "Not found", 404
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
 
 @app.route('/logout')
 def logout():
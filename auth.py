@@ -1,34 +1,33 @@
-from database import get_db_connection
-import bcrypt
+import sqlite3
+from database import get_db_connection, bump_profile_generation
+from profile_cache import invalidate_profile
+from password_hashing import HashingBusy, hasher, needs_rehash
 from config import Config
 
 def register_user(username, password):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT username FROM Users WHERE username = ?", (username,))
-    if cursor.fetchone():
+    if conn.execute("SELECT username FROM Users WHERE username = ?", (username,)).fetchone():
         return False
-    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    cursor.execute(
-        "INSERT INTO Users (username, password_hash) VALUES (?, ?)",
-        (username, password_hash)
-    )
-    conn.commit()
-    conn.close()
+    password_hash = hasher.hash(password)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO Users (username, password_hash) VALUES (?, ?)",
+                (username, password_hash)
+            )
+    except sqlite3.IntegrityError:
+        return False  # taken by a concurrent sign-up while the password was being hashed
     return True
 
 def verify_user(username, password):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
+    user = get_db_connection().execute(
         "SELECT user_id, username, password_hash FROM Users WHERE username = ?",
         (username,)
-    )
-    user = cursor.fetchone()
-    conn.close()
+    ).fetchone()
     
-    if user and bcrypt.checkpw(password.encode('utf-8'), user['password_hash']):
+    if user and hasher.check(password, user['password_hash']):
+        if needs_rehash(user['password_hash']):
+            _rehash(user['user_id'], password)
         return {
             'user_id': user['user_id'],
             'username': user['username']
@@ -36,10 +35,17 @@ def verify_user(username, password):
     return None
 
 
+def _rehash(user_id, password):
+    """Re-hash a password at the configured cost after a successful login."""
+    try:
+        password_hash = hasher.hash(password)
+    except HashingBusy:
+        return  # try again on a later login
+    with get_db_connection() as conn:
+        conn.execute("UPDATE Users SET password_hash = ? WHERE user_id = ?", (password_hash, user_id))
+
+
 def update_user_profile(user_id, updates):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     valid_fields = ['language', 'tone', 'persona_type', 'persona_key', 'custom_persona', 'explanation_style']
     updates = {k: v for k, v in updates.items() if k in valid_fields}
     
@@ -48,10 +54,10 @@ def update_user_profile(user_id, updates):
         values = list(updates.values())
         values.append(user_id)
         
-        cursor.execute(
-            f"UPDATE Users SET {set_clause} WHERE user_id = ?",
-            values
-        )
-        conn.commit()
-    
-    conn.close()
\ No newline at end of file
+        with get_db_connection() as conn:
+            conn.execute(
+                f"UPDATE Users SET {set_clause} WHERE user_id = ?",
+                values
+            )
+            bump_profile_generation(conn)
+        invalidate_profile(user_id)
\ No newline at end of file
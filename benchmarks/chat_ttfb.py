@@ -0,0 +1,78 @@
+"""Measure time-to-first-token and total time of /chat replies, streamed vs blocking.
+
+Start the stub server and the app pointed at it, then:
+
+    python benchmarks/chat_ttfb.py --base-url http://127.0.0.1:5000 --username bench --password bench
+"""
+import argparse
+import json
+import statistics
+import time
+
+import requests
+
+
+def login(session: requests.Session, base_url: str, username: str, password: str):
+    session.post(f"{base_url}/register", data={'username': username, 'password': password})
+    response = session.post(f"{base_url}/login", data={'username': username, 'password': password})
+    response.raise_for_status()
+    if 'session' not in session.cookies:
+        raise SystemExit("Login failed")
+
+
+def new_chat(session: requests.Session, base_url: str) -> str:
+    response = session.post(f"{base_url}/chat", data={'new_chat': '1'}, allow_redirects=False)
+    return response.headers['Location'].rsplit('chat_id=', 1)[1]
+
+
+def time_request(session: requests.Session, base_url: str, chat_id: str, message: str, stream: bool):
+    data = {'chat_id': chat_id, 'message': message}
+    if stream:
+        data['stream'] = '1'
+    start = time.perf_counter()
+    first_token = None
+    with session.post(f"{base_url}/chat", data=data, stream=stream) as response:
+        response.raise_for_status()
+        if stream:
+            for line in response.iter_lines():
+                if first_token is None and line.startswith(b'data: {"token"'):
+                    first_token = time.perf_counter() - start
+        else:
+            response.json()
+    total = time.perf_counter() - start
+    return (first_token if first_token is not None else total), total
+
+
+def summarize(samples):
+    return {
+        'p50_ms': round(statistics.median(samples) * 1000, 1),
+        'max_ms': round(max(samples) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--username', default='bench')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--message', default='How do I manage my time during exam season?')
+    args = parser.parse_args()
+
+    session = requests.Session()
+    login(session, args.base_url, args.username, args.password)
+    chat_id = new_chat(session, args.base_url)
+
+    results = {}
+    for mode, stream in (('blocking', False), ('streaming', True)):
+        samples = [time_request(session, args.base_url, chat_id, f"{args.message} #{i}", stream)
+                   for i in range(args.requests)]
+        results[mode] = {
+            'ttfb': summarize([s[0] for s in samples]),
+            'total': summarize([s[1] for s in samples]),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Compare FAISS index types on recall@k, query latency and memory against the flat index.
+
+Uses the current version's ingested vectors (embeddings.npy) by default, or a synthetic
+corpus to see how each index scales:
+
+    python benchmarks/index_benchmark.py
+    python benchmarks/index_benchmark.py --synthetic 200000 --dimension 1536
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import index_store  # noqa: E402
+from config import Config  # noqa: E402
+from vector_index import build_index, configure_search, index_memory_bytes  # noqa: E402
+
+
+def load_vectors(args) -> np.ndarray:
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((max(1, args.synthetic // 500), args.dimension)).astype('float32')
+        assignments = rng.integers(0, len(centers), args.synthetic)
+        noise = rng.standard_normal((args.synthetic, args.dimension)).astype('float32') * 0.3
+        return centers[assignments] + noise
+    directory = index_store.version_dir(index_store.current_version())  # the version being served
+    embeddings_path = os.path.join(directory, 'embeddings.npy')
+    if os.path.exists(embeddings_path):
+        return np.load(embeddings_path)
+    index = faiss.read_index(index_store.index_path(directory))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def make_queries(vectors: np.ndarray, count: int) -> np.ndarray:
+    """Perturbed corpus vectors, so the nearest neighbours are non-trivial."""
+    rng = np.random.default_rng(1)
+    picks = vectors[rng.choice(len(vectors), min(count, len(vectors)), replace=False)]
+    scale = float(np.std(vectors)) * 0.5
+    return (picks + rng.standard_normal(picks.shape).astype('float32') * scale).astype('float32')
+
+
+def time_queries(index: faiss.Index, queries: np.ndarray, k: int):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies)
+
+
+def recall_at_k(results: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(r) & set(t)) / k for r, t in zip(results, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--synthetic', type=int, default=0, help='Generate this many synthetic vectors')
+    parser.add_argument('--dimension', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=Config.TOP_K_RESULTS)
+    parser.add_argument('--types', default='flat,ivf_flat,ivf_pq,hnsw')
+    parser.add_argument('--nprobe', default='1,4,8,16,32', help='nprobe values to sweep for IVF indexes')
+    parser.add_argument('--ef-search', default='16,32,64,128', help='efSearch values to sweep for HNSW')
+    args = parser.parse_args()
+
+    vectors = np.ascontiguousarray(load_vectors(args), dtype='float32')
+    queries = make_queries(vectors, args.queries)
+
+    exact = build_index(vectors, 'flat')
+    truth, _ = time_queries(exact, queries, args.k)
+
+    report = {'vectors': int(len(vectors)), 'dimension': int(vectors.shape[1]), 'k': args.k, 'results': []}
+    for index_type in args.types.split(','):
+        start = time.perf_counter()
+        index = build_index(vectors, index_type)
+        build_seconds = time.perf_counter() - start
+
+        if index_type.startswith('ivf'):
+            sweep = [('nprobe', int(v)) for v in args.nprobe.split(',')]
+        elif index_type == 'hnsw':
+            sweep = [('efSearch', int(v)) for v in args.ef_search.split(',')]
+        else:
+            sweep = [(None, None)]
+
+        for knob, value in sweep:
+            if knob == 'nprobe':
+                configure_search(index, nprobe=value)
+            elif knob == 'efSearch':
+                configure_search(index, ef_search=value)
+            results, latencies = time_queries(index, queries, args.k)
+            report['results'].append({
+                'index_type': index_type,
+                'param': f"{knob}={value}" if knob else None,
+                f'recall@{args.k}': round(recall_at_k(results, truth), 4),
+                'latency_p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 4),
+                'latency_p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 4),
+                'memory_mb': round(index_memory_bytes(index) / 2**20, 2),
+                'build_seconds': round(build_seconds, 2),
+            })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
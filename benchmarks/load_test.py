@@ -0,0 +1,226 @@
+"""End-to-end load test: concurrent users doing login -> chat -> history against gunicorn.
+
+Starts the stub OpenAI server and the app under gunicorn (pointed at the stub
+and a throwaway database), drives them with simulated users, and prints
+throughput and p50/p95/p99 per route as JSON. Needs an ingested vector store
+built with the stub's embeddings (see stub_openai.py).
+
+    python benchmarks/load_test.py --users 20 --duration 30 --latency-ms 200 --output run.json
+
+Use --base-url to run against an app that is already running instead.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+from stats import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MESSAGES = [
+    "How do I prepare for a supplementary exam?",
+    "What are DP requirements?",
+    "How can I manage my time during exam season?",
+    "I'm feeling overwhelmed in my first year, any advice?",
+    "How do I deal with culture shock on campus?",
+    "What should I do in the vacation to get ahead?",
+]
+
+
+def summarize(samples, errors: int, elapsed: float) -> dict:
+    samples = sorted(samples)
+    summary = {'count': len(samples), 'errors': errors, 'throughput_rps': round(len(samples) / elapsed, 2)}
+    if samples:
+        summary.update({
+            'p50_ms': round(percentile(samples, 50) * 1000, 1),
+            'p95_ms': round(percentile(samples, 95) * 1000, 1),
+            'p99_ms': round(percentile(samples, 99) * 1000, 1),
+            'max_ms': round(samples[-1] * 1000, 1),
+        })
+    return summary
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def timed(self, route: str, call):
+        start = time.perf_counter()
+        try:
+            response = call()
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            if ok:
+                self.samples[route].append(elapsed)
+            else:
+                self.errors[route] += 1
+        return response
+
+
+def simulate_user(base_url: str, user: int, deadline: float, recorder: Recorder, args):
+    session = requests.Session()
+    username = f"load-{args.run_id}-{user}"
+    recorder.timed('POST /register', lambda: session.post(
+        f"{base_url}/register", data={'username': username, 'password': 'load'}, allow_redirects=False))
+    recorder.timed('POST /login', lambda: session.post(
+        f"{base_url}/login", data={'username': username, 'password': 'load'}, allow_redirects=False))
+    response = recorder.timed('POST /chat (new)', lambda: session.post(
+        f"{base_url}/chat", data={'new_chat': '1'}, allow_redirects=False))
+    if response is None or 'chat_id=' not in response.headers.get('Location', ''):
+        return
+    chat_id = response.headers['Location'].rsplit('chat_id=', 1)[1]
+
+    rng = random.Random(user)
+    turn = 0
+    while time.monotonic() < deadline:
+        data = {'chat_id': chat_id, 'message': f"{rng.choice(MESSAGES)} ({turn})"}
+        if args.stream:
+            data['stream'] = '1'
+            recorder.timed('POST /chat (stream)', lambda: _drain(session.post(f"{base_url}/chat", data=data, stream=True)))
+        else:
+            recorder.timed('POST /chat', lambda: session.post(f"{base_url}/chat", data=data))
+        recorder.timed('GET /chat', lambda: session.get(f"{base_url}/chat", params={'chat_id': chat_id}))
+        if turn % args.history_every == 0:
+            recorder.timed('GET /history', lambda: session.get(f"{base_url}/history"))
+        turn += 1
+        if args.think_ms:
+            time.sleep(rng.uniform(0, 2 * args.think_ms) / 1000)
+
+
+def _drain(response: requests.Response) -> requests.Response:
+    with response:
+        for _ in response.iter_content(chunk_size=None):
+            pass
+    return response
+
+
+def wait_until_up(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1, allow_redirects=False)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise SystemExit(f"{url} did not come up within {timeout:.0f}s")
+
+
+def start_servers(args, workdir: str):
+    """Start the stub and gunicorn; returns (base_url, processes)."""
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=f"http://127.0.0.1:{args.stub_port}/v1",
+        OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY', 'stub'),
+        DATABASE_PATH=os.path.join(workdir, 'load.db'),
+        EMBEDDING_CACHE_PATH=os.path.join(workdir, 'embedding_cache.db'),
+    )
+    subprocess.run([sys.executable, 'database.py', 'migrate'], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'benchmarks', 'stub_openai.py'),
+        '--port', str(args.stub_port), '--latency-ms', str(args.latency_ms),
+        '--tokens-per-second', str(args.tokens_per_second),
+        '--completion-tokens', str(args.completion_tokens),
+        '--slow-ratio', str(args.slow_ratio), '--slow-latency-ms', str(args.slow_latency_ms),
+        '--error-ratio', str(args.error_ratio),
+    ])
+    app = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+        '--bind', f"127.0.0.1:{args.port}", '--timeout', '120', '--log-level', 'warning', 'app:app',
+    ], cwd=ROOT, env=env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_up(f"http://127.0.0.1:{args.stub_port}/")
+        wait_until_up(f"{base_url}/login")
+    except BaseException:
+        stop([stub, app])
+        raise
+    return base_url, [stub, app]
+
+
+def stop(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url', help="benchmark a running app instead of starting one")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=30, help="seconds of chat traffic per user")
+    parser.add_argument('--think-ms', type=float, default=0, help="mean pause between a user's requests")
+    parser.add_argument('--history-every', type=int, default=3, help="visit /history every N chat turns")
+    parser.add_argument('--stream', action='store_true', help="request streamed (SSE) replies")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--stub-port', type=int, default=8955)
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--tokens-per-second', type=float, default=200)
+    parser.add_argument('--completion-tokens', type=int, default=60)
+    parser.add_argument('--slow-ratio', type=float, default=0, help="fraction of upstream calls made slow")
+    parser.add_argument('--slow-latency-ms', type=float, default=3000)
+    parser.add_argument('--error-ratio', type=float, default=0, help="fraction of upstream calls failing with 500")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    args = parser.parse_args()
+    args.run_id = f"{int(time.time())}-{os.getpid()}"
+
+    workdir = tempfile.mkdtemp(prefix='load-test-')
+    processes = []
+    try:
+        if args.base_url:
+            base_url = args.base_url.rstrip('/')
+        else:
+            base_url, processes = start_servers(args, workdir)
+
+        recorder = Recorder()
+        start = time.perf_counter()
+        deadline = time.monotonic() + args.duration
+        users = [threading.Thread(target=simulate_user, args=(base_url, user, deadline, recorder, args))
+                 for user in range(args.users)]
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        stop(processes)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    routes = sorted(set(recorder.samples) | set(recorder.errors))
+    report = {
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'run_id')},
+        'elapsed_s': round(elapsed, 2),
+        'routes': {route: summarize(recorder.samples[route], recorder.errors[route], elapsed) for route in routes},
+        'total': summarize([s for samples in recorder.samples.values() for s in samples],
+                           sum(recorder.errors.values()), elapsed),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Micro-benchmarks for chunking, retrieval, prompt construction and database.py, as JSON.
+
+Retrieval runs against the configured vector store with random query
+vectors, so no embedding calls are made. Database benchmarks use a fresh
+throwaway database unless --database is given.
+
+    python benchmarks/micro_benchmarks.py --iterations 200 --output micro.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stats import percentile
+
+WORDS = ("student exam lecture tutorial deadline residence library bursary module assignment "
+         "semester registration wellbeing mentor orientation timetable").split()
+
+
+def measure(function, iterations: int, warmup: int = 3) -> dict:
+    for _ in range(min(warmup, iterations)):
+        function()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        'iterations': iterations,
+        'ops_per_s': round(iterations / sum(samples), 1) if sum(samples) else None,
+        'mean_us': round(sum(samples) / iterations * 1e6, 1),
+        'p50_us': round(percentile(samples, 50) * 1e6, 1),
+        'p95_us': round(percentile(samples, 95) * 1e6, 1),
+        'p99_us': round(percentile(samples, 99) * 1e6, 1),
+    }
+
+
+def synthetic_pages(count: int, words_per_page: int = 400):
+    rng = random.Random(0)
+    return [(number, " ".join(rng.choice(WORDS) for _ in range(words_per_page)))
+            for number in range(1, count + 1)]
+
+
+def bench_chunking(iterations: int) -> dict:
+    from pdf_ingest import chunk_pages
+
+    pages = synthetic_pages(100)
+    return {'chunk_pages (100 pages)': measure(lambda: list(chunk_pages(pages)), iterations)}
+
+
+def bench_retrieval(iterations: int) -> dict:
+    import numpy as np
+    from chat_handler import chat_handler
+
+    profile = {'tone': 'warm', 'persona_type': 'predefined', 'persona_key': '', 'explanation_style': 'detailed'}
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((64, chat_handler.index.d)).astype('float32').tolist()
+    texts = [" ".join(random.Random(i).choice(WORDS) for _ in range(6)) for i in range(64)]
+    position = iter(range(1 << 62))
+
+    def vector_search():
+        chat_handler.get_relevant_chunks(queries[next(position) % 64])
+
+    def hybrid_search():
+        i = next(position) % 64
+        chat_handler.get_relevant_chunks(queries[i], texts[i])
+
+    chunks = chat_handler.get_relevant_chunks(queries[0], texts[0])
+    prefix = chat_handler.build_system_prefix(profile)
+    return {
+        'get_relevant_chunks (vector)': measure(vector_search, iterations),
+        'get_relevant_chunks (hybrid)': measure(hybrid_search, iterations),
+        'construct_prompt': measure(
+            lambda: chat_handler.construct_prompt(profile, chunks, texts[0]), iterations),
+        'construct_prompt (cached prefix)': measure(
+            lambda: chat_handler.construct_prompt(profile, chunks, texts[0], system_prefix=prefix), iterations),
+    }
+
+
+def bench_database(iterations: int) -> dict:
+    import database
+
+    user_id = database.add_user(f"micro-{os.getpid()}-{time.time()}", 'not-a-real-hash')
+    chat_id = database.create_new_chat(user_id)
+    for turn in range(100):
+        database.add_chat_turn(chat_id, user_id, f"question {turn}", f"answer {turn}")
+    turns = iter(range(1 << 62))
+
+    results = {
+        'add_chat_turn': measure(
+            lambda: database.add_chat_turn(chat_id, user_id, f"question {next(turns)}", "answer"), iterations),
+        'create_new_chat': measure(lambda: database.create_new_chat(user_id), iterations),
+        'get_user': measure(lambda: database.get_user(user_id), iterations),
+        'get_user_profile': measure(lambda: database.get_user_profile(user_id), iterations),
+        'get_user_chats_page': measure(lambda: database.get_user_chats_page(user_id), iterations),
+        'get_chat_messages_page': measure(lambda: database.get_chat_messages_page(chat_id, user_id), iterations),
+        'get_recent_messages': measure(lambda: database.get_recent_messages(chat_id), iterations),
+        'get_user_chats': measure(lambda: database.get_user_chats(user_id), iterations),
+        'search_messages': measure(lambda: database.search_messages(user_id, "answer question"), iterations),
+    }
+    database.message_writer.flush()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--only', choices=('chunking', 'retrieval', 'database'), action='append',
+                        help="run only these groups (repeatable)")
+    parser.add_argument('--database', help="benchmark against this database instead of a temporary one")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    # Must be set before database.py (and anything importing it) is loaded.
+    workdir = tempfile.mkdtemp(prefix='micro-bench-')
+    os.environ['DATABASE_PATH'] = args.database or os.path.join(workdir, 'micro.db')
+    import database
+    if args.database:
+        database.check_schema()
+    else:
+        database.migrate()
+
+    groups = {'chunking': bench_chunking, 'retrieval': bench_retrieval, 'database': bench_database}
+    report = {'iterations': args.iterations}
+    try:
+        for name, bench in groups.items():
+            if not args.only or name in args.only:
+                report[name] = bench(args.iterations)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
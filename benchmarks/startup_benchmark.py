@@ -0,0 +1,124 @@
+"""Measure startup cost: app import time, ChatHandler cold start and gunicorn worker boot.
+
+ChatHandler is measured with and without mmap loading, and gunicorn with
+and without preloading the app (and index) in the master. Uses a
+throwaway database, migrated before the runs.
+
+    python benchmarks/startup_benchmark.py --workers 4
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import resource, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+HANDLER_PROBE = """
+import resource, time
+start = time.perf_counter()
+from chat_handler import chat_handler
+chat_handler.get_relevant_chunks([0.0] * chat_handler.index.d)
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def probe(code: str, env_overrides: dict, runs: int = 3) -> dict:
+    env = dict(os.environ, **env_overrides)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True).stdout.split()
+        samples.append((float(output[-2]), int(output[-1])))
+    return {
+        'startup_ms': round(min(s[0] for s in samples) * 1000, 1),
+        'max_rss_mb': round(min(s[1] for s in samples) / 1024, 1),
+    }
+
+
+def private_mb(pid: int) -> float:
+    """Memory only this process uses (not shared copy-on-write with the master), from smaps_rollup."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return 0.0
+    return sum(int(fields.get(name, '0 kB').split()[0]) for name in ('Private_Clean', 'Private_Dirty')) / 1024
+
+
+def gunicorn_boot(env_overrides: dict, workers: int, port: int) -> dict:
+    """Time until gunicorn serves /login, and its workers' private memory at that point.
+
+    Without preloading, workers load the index lazily on their first chat
+    message, so their memory here excludes it.
+    """
+    env = dict(os.environ, **env_overrides)
+    start = time.perf_counter()
+    server = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f"127.0.0.1:{port}",
+        '--log-level', 'warning', 'app:app',
+    ], cwd=ROOT, env=env)
+    try:
+        while True:
+            try:
+                requests.get(f"http://127.0.0.1:{port}/login", timeout=1)
+                break
+            except requests.RequestException:
+                if server.poll() is not None or time.perf_counter() - start > 120:
+                    raise SystemExit("gunicorn did not start")
+                time.sleep(0.05)
+        ready = time.perf_counter() - start
+        time.sleep(1)  # let the remaining workers finish booting
+        children = subprocess.run(['pgrep', '-P', str(server.pid)], capture_output=True, text=True).stdout.split()
+        return {
+            'ready_ms': round(ready * 1000, 1),
+            'worker_private_mb': round(sum(private_mb(int(pid)) for pid in children), 1),
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--skip-gunicorn', action='store_true')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='startup-bench-')
+    database = {'DATABASE_PATH': os.path.join(workdir, 'startup.db')}
+    try:
+        subprocess.run([sys.executable, 'database.py', 'migrate'], cwd=ROOT, env=dict(os.environ, **database),
+                       check=True, stdout=subprocess.DEVNULL)
+        report = {
+            'import_app': probe(IMPORT_PROBE, database),
+            'chat_handler_mmap': probe(HANDLER_PROBE, dict(database, FAISS_MMAP='true')),
+            'chat_handler_no_mmap': probe(HANDLER_PROBE, dict(database, FAISS_MMAP='false')),
+        }
+        if not args.skip_gunicorn:
+            report['gunicorn_preload'] = gunicorn_boot(dict(database, GUNICORN_PRELOAD='true'),
+                                                       args.workers, args.port)
+            report['gunicorn_per_worker'] = gunicorn_boot(dict(database, GUNICORN_PRELOAD='false'),
+                                                          args.workers, args.port)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
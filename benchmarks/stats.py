@@ -0,0 +1,8 @@
+"""Summary statistics shared by the benchmark scripts."""
+import math
+
+
+def percentile(sorted_samples, q: float) -> float:
+    """Nearest-rank percentile of already sorted samples."""
+    index = max(0, min(len(sorted_samples) - 1, math.ceil(q / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
@@ -0,0 +1,192 @@
+"""Minimal OpenAI-compatible stub server for local testing and benchmarks.
+
+Run it and point the app at it:
+
+    python benchmarks/stub_openai.py --port 8900 --latency-ms 150
+
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=stub python -c "..."
+
+Tail latency and outages can be injected to exercise timeouts, hedging and
+the circuit breaker, e.g. ``--slow-ratio 0.05 --slow-latency-ms 3000`` or
+``--error-ratio 1``.
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class StubSettings:
+    latency_ms = 0.0
+    dimension = 1536
+    rate_limit_ratio = 0.0
+    error_ratio = 0.0
+    slow_ratio = 0.0
+    slow_latency_ms = 0.0
+    tokens_per_second = 50.0
+    completion_tokens = 120
+
+
+def fake_embedding(text: str, dimension: int) -> list:
+    """Deterministic unit vector derived from the text, so repeats match."""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype('float32')
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        payload = self._read_json()
+        if random.random() < StubSettings.rate_limit_ratio:
+            self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit'}})
+            return
+        if random.random() < StubSettings.slow_ratio:
+            time.sleep(StubSettings.slow_latency_ms / 1000)
+        else:
+            time.sleep(StubSettings.latency_ms / 1000)
+        if random.random() < StubSettings.error_ratio:
+            self._send_json(500, {'error': {'message': 'Injected server error', 'type': 'server_error'}})
+            return
+
+        if self.path.endswith('/embeddings'):
+            self._handle_embeddings(payload)
+        elif self.path.endswith('/chat/completions'):
+            self._handle_chat(payload)
+        else:
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+
+    def _handle_embeddings(self, payload: dict):
+        inputs = payload.get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        data = [
+            {'object': 'embedding', 'index': i, 'embedding': fake_embedding(text, StubSettings.dimension)}
+            for i, text in enumerate(inputs)
+        ]
+        tokens = sum(len(text.split()) for text in inputs)
+        self._send_json(200, {
+            'object': 'list',
+            'data': data,
+            'model': payload.get('model', 'stub'),
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        })
+
+    def _completion_tokens(self) -> list:
+        words = ["This", "is", "a", "stubbed", "answer", "from", "the", "study", "guides."]
+        return [words[i % len(words)] + " " for i in range(StubSettings.completion_tokens)]
+
+    def _handle_chat(self, payload: dict):
+        tokens = self._completion_tokens()
+        delay = 1 / StubSettings.tokens_per_second if StubSettings.tokens_per_second > 0 else 0
+        prompt_tokens = sum(len(str(m.get('content', '')).split()) for m in payload.get('messages', []))
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(tokens),
+            'total_tokens': prompt_tokens + len(tokens),
+        }
+        base = {
+            'id': 'chatcmpl-stub',
+            'created': int(time.time()),
+            'model': payload.get('model', 'stub'),
+        }
+
+        if not payload.get('stream'):
+            time.sleep(delay * len(tokens))
+            self._send_json(200, dict(base, object='chat.completion', usage=usage, choices=[{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': "".join(tokens)},
+                'finish_reason': 'stop',
+            }]))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                time.sleep(delay)
+                delta = {'content': token} if i else {'role': 'assistant', 'content': token}
+                self._write_event(dict(base, object='chat.completion.chunk', choices=[
+                    {'index': 0, 'delta': delta, 'finish_reason': None}
+                ]))
+            self._write_event(dict(base, object='chat.completion.chunk', choices=[
+                {'index': 0, 'delta': {}, 'finish_reason': 'stop'}
+            ]))
+            if payload.get('stream_options', {}).get('include_usage'):
+                self._write_event(dict(base, object='chat.completion.chunk', choices=[], usage=usage))
+            self._write_chunk(b'data: [DONE]\n\n')
+            self._write_chunk(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _write_event(self, payload: dict):
+        self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Fixed delay added to every request')
+    parser.add_argument('--dimension', type=int, default=1536, help='Embedding dimension to return')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0,
+                        help='Fraction of requests answered with HTTP 429')
+    parser.add_argument('--error-ratio', type=float, default=0.0,
+                        help='Fraction of requests answered with HTTP 500 after the delay')
+    parser.add_argument('--slow-ratio', type=float, default=0.0,
+                        help='Fraction of requests delayed by --slow-latency-ms instead of --latency-ms')
+    parser.add_argument('--slow-latency-ms', type=float, default=0.0, help='Delay for the slow fraction')
+    parser.add_argument('--tokens-per-second', type=float, default=50.0,
+                        help='Rate at which chat completion tokens are produced')
+    parser.add_argument('--completion-tokens', type=int, default=120,
+                        help='Number of tokens in every chat completion')
+    return parser
+
+
+def serve(args: argparse.Namespace) -> ThreadingHTTPServer:
+    StubSettings.latency_ms = args.latency_ms
+    StubSettings.dimension = args.dimension
+    StubSettings.rate_limit_ratio = args.rate_limit_ratio
+    StubSettings.error_ratio = args.error_ratio
+    StubSettings.slow_ratio = args.slow_ratio
+    StubSettings.slow_latency_ms = args.slow_latency_ms
+    StubSettings.tokens_per_second = args.tokens_per_second
+    StubSettings.completion_tokens = args.completion_tokens
+    return ThreadingHTTPServer((args.host, args.port), StubHandler)
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    server = serve(args)
+    print(f"Stub OpenAI server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
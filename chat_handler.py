@@ -1,67 +1,324 @@
-import os
-import pickle
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 import numpy as np
-import faiss
+import os
+import chunk_store
+import index_store
+import lexical_index
 from config import Config
-from typing import List, Dict
+from embedding_backends import check_compatible, get_backend
+from embedding_cache import get_embedding_cache
+from metrics import observe_stage, record_tokens, record_upstream, stage
+from retrieval import count_tokens, format_excerpt, reciprocal_rank_fusion, select_context
+from response_cache import ResponseCache, make_bucket
+from profile_cache import ProfileCache
+from vector_index import configure_search, id_selector, read_index, search_params
+from upstream import (UPSTREAM_ERRORS, CircuitOpen, Deadline, DeadlineExceeded, chat_breaker, embedding_breaker,
+                      embedding_latencies, hedged, with_retries)
+from typing import List, Dict, Iterator, Optional, Tuple
 import openai
 from constants import TONE_PRESETS, PREDEFINED_PERSONAS, LEARNING_STYLES
 
+# Completion failures that are answered from the retrieved excerpts instead of an error page.
+FALLBACK_ERRORS = UPSTREAM_ERRORS + (CircuitOpen, DeadlineExceeded)
+FALLBACK_INTRO = ("I can't reach the assistant model right now, so here are the most relevant "
+                  "passages from the study guides:\n\n")
+
+class IndexSnapshot:
+    """One loaded version of the vector store. Its lease is released once the last reference is dropped."""
+
+    def __init__(self, version):
+        self.version = version
+        lease = index_store.VersionLease(version)
+        weakref.finalize(self, lease.release)
+        directory = index_store.version_dir(version)
+        self.index = configure_search(read_index(index_store.index_path(directory)))
+        check_compatible(index_store.read_manifest(directory), self.index.d)
+        self.metadata = chunk_store.load(directory)
+        embeddings_path = os.path.join(directory, 'embeddings.npy')
+        # Stored chunk vectors for near-duplicate filtering and MMR; absent in older stores
+        self.vectors = np.load(embeddings_path, mmap_mode='r') if os.path.exists(embeddings_path) else None
+        self.lexical = lexical_index.load(directory)
+        self.sources = chunk_store.load_sources(directory, self.metadata)
+
+    def id_ranges(self, sources: Optional[List[str]]) -> Optional[List[Tuple[int, int]]]:
+        """Chunk ID ranges of the given sources; None means unrestricted, [] matches nothing."""
+        if not sources:
+            return None
+        return [tuple(span) for source in sources for span in self.sources.get(source, ())]
+
 class ChatHandler:
+    """Retrieval and completion for chat messages.
+
+    The index is loaded on first use rather than at import, so importing
+    the app stays cheap; call preload() to load it up front, e.g. in the
+    gunicorn master so forked workers share its memory.
+    """
+
     def __init__(self):
+        self.embedding_model = Config.EMBEDDING_MODEL
+        self._snapshot = None
+        self._load_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self.embedding_latency = None  # moving average of uncached embedding calls, in seconds
+        self.embedding_failures = 0  # consecutive failed embedding calls
+        self._next_reload_check = time.monotonic() + Config.INDEX_RELOAD_INTERVAL
+
+    @property
+    def snapshot(self) -> IndexSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._load_lock:
+                if self._snapshot is None:
+                    try:
+                        self._snapshot = IndexSnapshot(index_store.current_version())
+                    except Exception as e:
+                        raise RuntimeError(f"Initialization failed: {str(e)}")
+                snapshot = self._snapshot
+        return snapshot
+
+    def preload(self) -> IndexSnapshot:
+        """Load the current index version now instead of on the first message."""
+        return self.snapshot
+
+    @property
+    def index(self):
+        return self.snapshot.index
+
+    @property
+    def metadata(self):
+        return self.snapshot.metadata
+
+    def maybe_reload(self):
+        """Load a newly published index version in the background and swap it in.
+
+        Searches already running keep their reference to the old snapshot, so
+        nothing blocks; the old version is collected once no process uses it.
+        """
+        now = time.monotonic()
+        if Config.INDEX_RELOAD_INTERVAL <= 0 or now < self._next_reload_check:
+            return
+        self._next_reload_check = now + Config.INDEX_RELOAD_INTERVAL
+        version = index_store.current_version()
+        if version == self.snapshot.version or not self._reload_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._reload, args=(version,), daemon=True).start()
+
+    def _reload(self, version):
         try:
-            self.embedding_model = Config.EMBEDDING_MODEL
-            self.index = faiss.read_index(Config.FAISS_INDEX_PATH)
-            
-            metadata_path = os.path.join(
-                os.path.dirname(Config.FAISS_INDEX_PATH), 
-                'metadata.pkl'
-            )
-            with open(metadata_path, 'rb') as f:
-                self.metadata = pickle.load(f)
-                
+            self._snapshot = IndexSnapshot(version)
+            index_store.collect_garbage()
         except Exception as e:
-            raise RuntimeError(f"Initialization failed: {str(e)}")
+            print(f"Reloading index version {version} failed: {e}")
+        finally:
+            self._reload_lock.release()
 
-    def get_embedding(self, text: str) -> List[float]:
-        clean_text = self._clean_text(text)
-        response = openai.embeddings.create(
-            input=clean_text,
-            model=self.embedding_model
+    def get_embedding(self, text: str, deadline: Optional[Deadline] = None) -> List[float]:
+        return self.get_embeddings([text], deadline)[0]
+
+    def get_embeddings(self, texts: List[str], deadline: Optional[Deadline] = None) -> List[List[float]]:
+        """Embed many texts at once; the backend batches the uncached ones."""
+        clean_texts = [self._clean_text(text) for text in texts]
+        if not Config.EMBEDDING_CACHE_ENABLED:
+            return self._embed_uncached(clean_texts, deadline)
+        return get_embedding_cache().get_or_compute(
+            self.embedding_model, clean_texts, lambda missing: self._embed_uncached(missing, deadline)
         )
-        return response.data[0].embedding
+
+    def _embed_uncached(self, texts: List[str], deadline: Optional[Deadline] = None) -> List[List[float]]:
+        """Call the backend through the circuit breaker, hedging single-query calls to remote backends."""
+        backend = get_backend()
+        # Only one-text calls are hedged and sampled, so batch calls don't skew the delay.
+        hedgeable = backend.remote and len(texts) == 1
+
+        def attempt() -> List[List[float]]:
+            attempt_started = time.perf_counter()
+            vectors = backend.embed(texts, deadline)
+            if hedgeable:
+                embedding_latencies.add(time.perf_counter() - attempt_started)
+            return vectors
+
+        started = time.perf_counter()
+        try:
+            vectors = embedding_breaker.call(
+                lambda: hedged('embeddings', attempt, self._hedge_delay() if hedgeable else None)
+            )
+        except Exception:
+            self.embedding_failures += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            previous = self.embedding_latency
+            self.embedding_latency = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+        self.embedding_failures = 0
+        return vectors
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not Config.EMBEDDING_HEDGE_ENABLED:
+            return None
+        delay = embedding_latencies.percentile(Config.EMBEDDING_HEDGE_PERCENTILE)
+        return None if delay is None else max(delay, Config.EMBEDDING_HEDGE_MIN_MS / 1000)
+
+    def embeddings_slow(self) -> bool:
+        """Whether the lexical fast path should take over: recent calls are slow, or the last one failed."""
+        if self.embedding_failures:
+            return True
+        return self.embedding_latency is not None and self.embedding_latency * 1000 > Config.EMBEDDING_SLOW_MS
+
+    def _probe_embedding(self, text: str):
+        """Keep measuring the backend in the background while the fast path avoids it."""
+        if not self._probe_lock.acquire(blocking=False):
+            return
+
+        def probe():
+            try:
+                self._embed_uncached([self._clean_text(text)])
+            except Exception:
+                pass
+            finally:
+                self._probe_lock.release()
+
+        threading.Thread(target=probe, daemon=True).start()
 
     def _clean_text(self, text: str) -> str:
         if isinstance(text, bytes):
             text = text.decode('utf-8', errors='ignore')
         return text.encode('utf-8', errors='ignore').decode('utf-8')
 
-    def get_relevant_chunks(self, query_embedding: List[float]) -> List[Dict]:
+    def retrieve(self, query: str, sources: Optional[List[str]] = None,
+                 deadline: Optional[Deadline] = None) -> Tuple[Optional[List[float]], List[Dict]]:
+        """Embed the query and fetch its context, or use BM25 alone when the fast path applies.
+
+        sources restricts retrieval to those guides. If embedding fails (slow,
+        erroring or circuit open) BM25 results are used instead when there are
+        any. Returns the query embedding (None on the lexical-only path) and
+        the chunks.
+        """
+        self.maybe_reload()
+        snapshot = self.snapshot
+        ranges = snapshot.id_ranges(sources)
+        lexical = None
+        if Config.LEXICAL_FAST_PATH_ENABLED and snapshot.lexical is not None:
+            with stage('retrieval'):
+                lexical = snapshot.lexical.search(query, self._fetch_k(), ranges)
+            ids, _, confidence = lexical
+            slow = self.embeddings_slow()
+            if ids and (confidence >= Config.LEXICAL_CONFIDENCE or slow):
+                if slow:
+                    self._probe_embedding(query)
+                with stage('retrieval'):
+                    return None, self._lexical_context(snapshot, ids)
+        try:
+            with stage('embedding'):
+                query_embedding = self.get_embedding(query, deadline)
+        except Exception as e:
+            if snapshot.lexical is None:
+                raise
+            with stage('retrieval'):
+                if lexical is None:
+                    lexical = snapshot.lexical.search(query, self._fetch_k(), ranges)
+                if not lexical[0]:
+                    raise
+                print(f"Embedding failed, answering from BM25 results: {e}")
+                record_upstream('embeddings', 'fallback')
+                return None, self._lexical_context(snapshot, lexical[0])
+        with stage('retrieval'):
+            return query_embedding, self._search(snapshot, query_embedding, query, ranges, lexical)
+
+    def get_relevant_chunks(self, query_embedding: List[float], query: Optional[str] = None,
+                            sources: Optional[List[str]] = None) -> List[Dict]:
+        """Vector search, fused with BM25 over the query text when it is given, optionally within sources."""
+        self.maybe_reload()
+        snapshot = self.snapshot
+        return self._search(snapshot, query_embedding, query, snapshot.id_ranges(sources))
+
+    def source_names(self) -> List[str]:
+        """Names of the guides in the current index, for source-scoped queries."""
+        return sorted(self.snapshot.sources)
+
+    def _fetch_k(self) -> int:
+        return Config.TOP_K_RESULTS * max(1, Config.RETRIEVAL_OVERFETCH)
+
+    def _lexical_context(self, snapshot: IndexSnapshot, ids: List[int]) -> List[Dict]:
+        return select_context(None, ids, [snapshot.metadata[idx] for idx in ids], None)
+
+    def retrieve_many(self, queries: List[str], sources: Optional[List[str]] = None,
+                      deadline: Optional[Deadline] = None) -> List[Tuple[List[float], List[Dict]]]:
+        """Batch form of retrieve: one embedding pass and one index.search over an n x d matrix.
+
+        Always uses the embeddings (no lexical fast path), so evaluation runs
+        see the same retrieval for every query.
+        """
+        if not queries:
+            return []
+        self.maybe_reload()
+        snapshot = self.snapshot
+        ranges = snapshot.id_ranges(sources)
+        with stage('embedding'):
+            embeddings = self.get_embeddings(queries, deadline)
+        with stage('retrieval'):
+            query_matrix = np.array(embeddings).astype('float32')
+            indices = self._index_search(snapshot, query_matrix, ranges)
+            return [
+                (embedding, self._select(snapshot, query_matrix[row], indices[row], query, ranges))
+                for row, (embedding, query) in enumerate(zip(embeddings, queries))
+            ]
+
+    def _index_search(self, snapshot: IndexSnapshot, query_matrix: np.ndarray,
+                      ranges: Optional[List[Tuple[int, int]]]) -> np.ndarray:
+        """FAISS IDs for each query row, restricted to ranges with an ID selector rather than post-filtering."""
+        if ranges is None:
+            distances, indices = snapshot.index.search(query_matrix, self._fetch_k())
+        elif not ranges:
+            return np.full((len(query_matrix), 0), -1, dtype='int64')
+        else:
+            params = search_params(snapshot.index, id_selector(ranges))
+            distances, indices = snapshot.index.search(query_matrix, self._fetch_k(), params=params)
+        return indices
+
+    def _search(self, snapshot: IndexSnapshot, query_embedding: List[float], query: Optional[str],
+                ranges: Optional[List[Tuple[int, int]]] = None, lexical: Optional[tuple] = None) -> List[Dict]:
         query_array = np.array([query_embedding]).astype('float32')
-        distances, indices = self.index.search(query_array, Config.TOP_K_RESULTS)
-        return [
-            self.metadata[idx] 
-            for idx in indices[0] 
-            if 0 <= idx < len(self.metadata)
-        ]
+        indices = self._index_search(snapshot, query_array, ranges)
+        return self._select(snapshot, query_array[0], indices[0], query, ranges, lexical)
 
-    def construct_prompt(self, user_profile: Dict, context_chunks: List[Dict], query: str) -> List[Dict]:
+    def _select(self, snapshot: IndexSnapshot, query_vector: np.ndarray, indices, query: Optional[str],
+                ranges: Optional[List[Tuple[int, int]]] = None, lexical: Optional[tuple] = None) -> List[Dict]:
+        """Fuse one query's FAISS hits with BM25 and pick its context."""
+        fetch_k = self._fetch_k()
+        ids = [int(idx) for idx in indices if 0 <= idx < len(snapshot.metadata)]
+        scores = None
+        if query and Config.HYBRID_SEARCH_ENABLED and snapshot.lexical is not None and ranges != []:
+            lexical_ids = (lexical or snapshot.lexical.search(query, fetch_k, ranges))[0]
+            ids, scores = reciprocal_rank_fusion([ids, lexical_ids], Config.RRF_K)
+            ids, scores = ids[:fetch_k], scores[:fetch_k]
+        return select_context(
+            query_vector, ids, [snapshot.metadata[idx] for idx in ids], snapshot.vectors, scores
+        )
+
+    def build_system_prefix(self, user_profile: Dict) -> str:
+        """The profile-dependent part of the system prompt, cached per user by profile_cache."""
         tone = TONE_PRESETS.get(user_profile.get('tone', 'warm'), '')
         persona = self._get_persona_prompt(user_profile)
         learning_style = LEARNING_STYLES.get(user_profile.get('explanation_style', 'detailed'), '')
-        
-        context_formatted = "\n".join(
-            f"Excerpt from {chunk['source']}, page {chunk['page']}: {chunk['text']}"
-            for chunk in context_chunks
-        )
-        
-        system_message = (
+        return (
             f"You are an academic assistant for South African students. "
             f"Respond in a {tone.lower()} manner. "
             f"{persona} "
             f"{learning_style} "
-            f"Use this context: {context_formatted}"
         )
+
+    def construct_prompt(self, user_profile: Dict, context_chunks: List[Dict], query: str,
+                         system_prefix: Optional[str] = None) -> List[Dict]:
+        if system_prefix is None:
+            system_prefix = self.build_system_prefix(user_profile)
+        
+        context_formatted = "\n".join(format_excerpt(chunk) for chunk in context_chunks)
+        
+        system_message = f"{system_prefix}Use this context: {context_formatted}"
         
         return [
             {"role": "system", "content": system_message},
@@ -73,32 +330,213 @@ class ChatHandler:
             return user_profile.get('custom_persona', '')
         return PREDEFINED_PERSONAS.get(user_profile.get('persona_key', ''), '')
 
-    def get_chat_response(self, messages: List[Dict]) -> str:
-        response = openai.chat.completions.create(
-            model=Config.OPENAI_MODEL,
-            messages=messages,
-            temperature=0.7
-        )
-        return response.choices[0].message.content
+    def get_chat_response(self, messages: List[Dict], deadline: Optional[Deadline] = None) -> str:
+        with stage('completion'):
+            response = chat_breaker.call(lambda: with_retries(
+                lambda timeout: openai.chat.completions.create(
+                    model=Config.OPENAI_MODEL,
+                    messages=messages,
+                    temperature=0.7,
+                    timeout=timeout
+                ),
+                deadline, Config.CHAT_TIMEOUT_SECONDS, Config.CHAT_MAX_RETRIES
+            ))
+        content = response.choices[0].message.content
+        self._record_usage(messages, response.usage, content)
+        return content
+
+    def stream_chat_response(self, messages: List[Dict], deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """Yield reply tokens as the model produces them.
+
+        The API timeout is CHAT_TIMEOUT_SECONDS, shortened to what is left of
+        the deadline when the call is made, and it applies to each network
+        read: it bounds the wait for the first token and each later gap
+        between tokens, not the length of the whole reply.
+        """
+        started = time.perf_counter()
+        stream = chat_breaker.call(lambda: with_retries(
+            lambda timeout: openai.chat.completions.create(
+                model=Config.OPENAI_MODEL,
+                messages=messages,
+                temperature=0.7,
+                stream=True,
+                stream_options={'include_usage': True},
+                timeout=timeout
+            ),
+            deadline, Config.CHAT_TIMEOUT_SECONDS, Config.CHAT_MAX_RETRIES
+        ))
+        parts = []
+        usage = None
+        try:
+            for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not parts:
+                        observe_stage('first_token', time.perf_counter() - started)
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
+            observe_stage('completion', time.perf_counter() - started)
+            self._record_usage(messages, usage, "".join(parts))
+
+    def _record_usage(self, messages: List[Dict], usage, completion: Optional[str]):
+        """Count upstream tokens, estimating them if the API did not report usage."""
+        if usage is not None:
+            record_tokens(usage.prompt_tokens or 0, usage.completion_tokens or 0)
+        else:
+            record_tokens(sum(count_tokens(m['content']) for m in messages), count_tokens(completion or ''))
 
 chat_handler = ChatHandler()
+response_cache = ResponseCache(
+    ttl_seconds=Config.RESPONSE_CACHE_TTL_SECONDS,
+    max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+    similarity_threshold=Config.RESPONSE_CACHE_SIMILARITY if Config.RESPONSE_CACHE_SEMANTIC else None
+)
 
-def process_query(user_id: int, message: str, chat_id: int) -> str:
-    from database import get_db_connection
-    
-    with get_db_connection() as conn:
-        user_profile = conn.execute(
-            "SELECT language, tone, persona_type, persona_key, custom_persona, explanation_style "
-            "FROM Users WHERE user_id = ?", 
-            (user_id,)
-        ).fetchone()
+def _load_profile(user_id: int):
+    from database import get_user_profile
     
-    query_embedding = chat_handler.get_embedding(message)
-    relevant_chunks = chat_handler.get_relevant_chunks(query_embedding)
-    
-    messages = chat_handler.construct_prompt(
-        user_profile=dict(user_profile),
-        context_chunks=relevant_chunks,
-        query=message
+    user_profile = get_user_profile(user_id)
+    return user_profile, chat_handler.build_system_prefix(user_profile)
+
+profile_cache = ProfileCache(
+    loader=_load_profile,
+    max_entries=Config.PROFILE_CACHE_MAX_ENTRIES,
+    ttl_seconds=Config.PROFILE_CACHE_TTL_SECONDS,
+    check_interval=Config.PROFILE_CACHE_CHECK_INTERVAL
+)
+
+def available_sources() -> List[str]:
+    return chat_handler.source_names()
+
+def _prepare_query(user_id: int, message: str, sources: Optional[List[str]] = None,
+                   deadline: Optional[Deadline] = None):
+    with stage('profile'):
+        user_profile, system_prefix = profile_cache.get(user_id)
+    query_embedding, relevant_chunks = chat_handler.retrieve(message, sources, deadline)
+    with stage('prompt'):
+        messages = chat_handler.construct_prompt(
+            user_profile=user_profile,
+            context_chunks=relevant_chunks,
+            query=message,
+            system_prefix=system_prefix
+        )
+    return user_profile, query_embedding, relevant_chunks, messages
+
+def _answer(user_profile: Dict, message: str, query_embedding, relevant_chunks: List[Dict],
+            messages: List[Dict], deadline: Optional[Deadline] = None) -> str:
+    if not Config.RESPONSE_CACHE_ENABLED:
+        return chat_handler.get_chat_response(messages, deadline)
+    return response_cache.get_or_compute(
+        make_bucket(user_profile, relevant_chunks), message, query_embedding,
+        lambda: chat_handler.get_chat_response(messages, deadline), deadline
     )
-    return chat_handler.get_chat_response(messages)
\ No newline at end of file
+
+def _fallback_answer(relevant_chunks: List[Dict], error: Exception) -> str:
+    """The retrieved excerpts themselves, for when the chat model fails, times out or its circuit is open."""
+    if not relevant_chunks:
+        raise error
+    print(f"Chat completion failed, answering with excerpts: {error}")
+    record_upstream('chat', 'fallback')
+    return FALLBACK_INTRO + "\n\n".join(format_excerpt(chunk) for chunk in relevant_chunks)
+
+def process_query(user_id: int, message: str, chat_id: int, sources: Optional[List[str]] = None,
+                  deadline: Optional[Deadline] = None) -> str:
+    """Answer one message, with every upstream call bounded by the deadline (see Deadline.for_request)."""
+    user_profile, query_embedding, relevant_chunks, messages = _prepare_query(user_id, message, sources, deadline)
+    try:
+        return _answer(user_profile, message, query_embedding, relevant_chunks, messages, deadline)
+    except FALLBACK_ERRORS as e:
+        return _fallback_answer(relevant_chunks, e)
+
+def process_queries(user_id: int, queries: List[str], concurrency: Optional[int] = None,
+                    sources: Optional[List[str]] = None) -> Iterator[Dict]:
+    """Answer many queries for one user, yielding a result dict per query as it completes.
+
+    Queries are embedded and searched BATCH_QUERY_SIZE at a time, and at most
+    `concurrency` completions (default BATCH_CONCURRENCY) run at once. Results
+    come in completion order and carry the query's position as 'index'; a
+    failed completion yields an 'error' instead of a 'response' (no excerpt
+    fallback, so evaluation runs can tell them apart), and so does every
+    query of a batch whose retrieval failed. Each retrieval batch gets its
+    own BATCH_DEADLINE_SECONDS and each completion its own
+    REQUEST_DEADLINE_SECONDS, with upstream errors retried within them. Nothing is
+    saved to chat history. sources restricts every query to those guides.
+    """
+    concurrency = max(1, min(concurrency or Config.BATCH_CONCURRENCY, Config.BATCH_CONCURRENCY))
+    with stage('profile'):
+        user_profile, system_prefix = profile_cache.get(user_id)
+
+    def answer(index: int, message: str, query_embedding, relevant_chunks: List[Dict]) -> Dict:
+        result = {
+            'index': index,
+            'query': message,
+            'sources': [
+                {'source': chunk['source'], 'start_page': chunk.get('start_page', chunk['page']),
+                 'end_page': chunk.get('end_page', chunk['page'])}
+                for chunk in relevant_chunks
+            ]
+        }
+        messages = chat_handler.construct_prompt(user_profile, relevant_chunks, message, system_prefix)
+        try:
+            result['response'] = _answer(user_profile, message, query_embedding, relevant_chunks, messages,
+                                         Deadline.for_request())
+        except Exception as e:
+            result['error'] = str(e)
+        return result
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        try:
+            for start in range(0, len(queries), Config.BATCH_QUERY_SIZE):
+                batch = queries[start:start + Config.BATCH_QUERY_SIZE]
+                try:
+                    retrieved = chat_handler.retrieve_many(batch, sources, Deadline.for_batch())
+                except Exception as e:
+                    # The response is already streaming: report the batch's queries and carry on.
+                    for offset, message in enumerate(batch):
+                        yield {'index': start + offset, 'query': message, 'error': str(e)}
+                    continue
+                for offset, (query_embedding, relevant_chunks) in enumerate(retrieved):
+                    # Keep the executor's queue short so results stream out while later batches are retrieved.
+                    while len(pending) >= 2 * concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield future.result()
+                    pending.add(executor.submit(
+                        answer, start + offset, batch[offset], query_embedding, relevant_chunks
+                    ))
+            for future in as_completed(pending):
+                yield future.result()
+        finally:
+            # The client went away: don't start completions nobody will read.
+            for future in pending:
+                future.cancel()
+
+def process_query_stream(user_id: int, message: str, chat_id: int, sources: Optional[List[str]] = None,
+                         deadline: Optional[Deadline] = None) -> Iterator[str]:
+    """Like process_query, but yields the reply as the model produces it."""
+    user_profile, query_embedding, relevant_chunks, messages = _prepare_query(user_id, message, sources, deadline)
+
+    bucket = None
+    if Config.RESPONSE_CACHE_ENABLED:
+        bucket = make_bucket(user_profile, relevant_chunks)
+        cached = response_cache.get(bucket, message, query_embedding)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    try:
+        for token in chat_handler.stream_chat_response(messages, deadline):
+            parts.append(token)
+            yield token
+    except FALLBACK_ERRORS as e:
+        if parts:
+            raise
+        yield _fallback_answer(relevant_chunks, e)
+        return
+    if bucket is not None:
+        response_cache.put(bucket, message, query_embedding, "".join(parts))
\ No newline at end of file
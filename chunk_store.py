@@ -0,0 +1,120 @@
+"""Offset-indexed, memory-mapped store of chunk metadata.
+
+Chunks are serialized as JSON records back to back in ``chunks.bin``; the
+record boundaries live in ``chunks.idx.npy`` (n + 1 uint64 offsets). Both
+files are memory-mapped read-only, so a record is only decoded when its
+FAISS ID is looked up and every worker process shares the same page cache.
+
+Migrate an existing pickle with:
+
+    python chunk_store.py migrate vector_store
+"""
+import json
+import mmap
+import os
+import pickle
+import sys
+from typing import Dict, Iterable, Iterator, List
+
+import numpy as np
+
+DATA_NAME = 'chunks.bin'
+OFFSETS_NAME = 'chunks.idx.npy'
+PICKLE_NAME = 'metadata.pkl'
+SOURCES_NAME = 'sources.json'
+
+
+def exists(directory: str) -> bool:
+    return all(os.path.exists(os.path.join(directory, name)) for name in (DATA_NAME, OFFSETS_NAME))
+
+
+def write(directory: str, records: Iterable[Dict]):
+    """Write records to the store, replacing any previous files atomically."""
+    os.makedirs(directory, exist_ok=True)
+    data_path = os.path.join(directory, DATA_NAME)
+    offsets = [0]
+    with open(data_path + '.tmp', 'wb') as f:
+        for record in records:
+            encoded = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            f.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    offsets_tmp = os.path.join(directory, 'chunks.idx.tmp.npy')
+    np.save(offsets_tmp, np.array(offsets, dtype='uint64'))
+    os.replace(data_path + '.tmp', data_path)
+    os.replace(offsets_tmp, os.path.join(directory, OFFSETS_NAME))
+
+
+class ChunkStore:
+    """Read-only, list-like view over a chunk store directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._offsets = np.load(os.path.join(directory, OFFSETS_NAME), mmap_mode='r')
+        with open(os.path.join(directory, DATA_NAME), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx: int) -> Dict:
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return json.loads(self._data[start:end])
+
+    def __iter__(self) -> Iterator[Dict]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+def load(directory: str):
+    """Open the chunk store in directory, falling back to a legacy metadata.pkl."""
+    if exists(directory):
+        return ChunkStore(directory)
+    with open(os.path.join(directory, PICKLE_NAME), 'rb') as f:
+        return pickle.load(f)
+
+
+def source_ranges(records: Iterable[Dict]) -> Dict[str, List[List[int]]]:
+    """Map each source to the [start, end) chunk ID ranges it occupies."""
+    ranges: Dict[str, List[List[int]]] = {}
+    previous = None
+    for idx, record in enumerate(records):
+        source = record['source']
+        if source == previous:
+            ranges[source][-1][1] = idx + 1
+        else:
+            ranges.setdefault(source, []).append([idx, idx + 1])
+        previous = source
+    return ranges
+
+
+def write_sources(directory: str, records: Iterable[Dict]):
+    with open(os.path.join(directory, SOURCES_NAME), 'w', encoding='utf-8') as f:
+        json.dump(source_ranges(records), f, ensure_ascii=False, indent=1, sort_keys=True)
+
+
+def load_sources(directory: str, records) -> Dict[str, List[List[int]]]:
+    """Source -> ID ranges table, rebuilt from the records for stores written before it existed."""
+    try:
+        with open(os.path.join(directory, SOURCES_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return source_ranges(records)
+
+
+def migrate_pickle(directory: str) -> int:
+    """Convert directory/metadata.pkl into a chunk store and return the number of chunks."""
+    with open(os.path.join(directory, PICKLE_NAME), 'rb') as f:
+        metadata = pickle.load(f)
+    write(directory, metadata)
+    return len(metadata)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        raise SystemExit("usage: python chunk_store.py migrate [vector_store_dir]")
+    target = sys.argv[2] if len(sys.argv) > 2 else 'vector_store'
+    count = migrate_pickle(target)
+    print(f"Migrated {count} chunks from {os.path.join(target, PICKLE_NAME)} to a chunk store")
@@ -5,11 +5,88 @@ load_dotenv()
 
 class Config:
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
     OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+    # OpenAI model name, or 'local:<sentence-transformers model>' for CPU inference in-process
     EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+    EMBEDDING_THREADS = int(os.getenv('EMBEDDING_THREADS', 0))  # torch threads for local models; 0 = default
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 100))
+    EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', 4))
+    EMBEDDING_MAX_RETRIES = int(os.getenv('EMBEDDING_MAX_RETRIES', 5))
+    CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', 500))  # words per chunk
+    CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', 50))  # words repeated at the start of the next chunk
+    INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 0))  # PDF extraction processes; 0 = one per core
+    INGEST_PAGES_PER_TASK = int(os.getenv('INGEST_PAGES_PER_TASK', 50))  # large PDFs are split into page ranges
+    INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 8))  # extracted documents waiting to be embedded
     FAISS_INDEX_PATH = os.getenv('FAISS_INDEX_PATH', 'vector_store/faiss_index')
+    INDEX_RELOAD_INTERVAL = float(os.getenv('INDEX_RELOAD_INTERVAL', 5))  # seconds; 0 disables hot reload
+    FAISS_MMAP = os.getenv('FAISS_MMAP', 'true').lower() == 'true'
+    FAISS_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'flat')  # flat, ivf_flat, ivf_pq or hnsw
+    FAISS_NLIST = int(os.getenv('FAISS_NLIST', 0))  # 0 picks ~4*sqrt(n)
+    FAISS_NPROBE = int(os.getenv('FAISS_NPROBE', 8))
+    FAISS_PQ_M = int(os.getenv('FAISS_PQ_M', 64))
+    FAISS_PQ_NBITS = int(os.getenv('FAISS_PQ_NBITS', 8))
+    FAISS_HNSW_M = int(os.getenv('FAISS_HNSW_M', 32))
+    FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv('FAISS_HNSW_EF_CONSTRUCTION', 200))
+    FAISS_EF_SEARCH = int(os.getenv('FAISS_EF_SEARCH', 64))
+    FAISS_TRAIN_SAMPLE = int(os.getenv('FAISS_TRAIN_SAMPLE', 50000))
     TOP_K_RESULTS = int(os.getenv('TOP_K_RESULTS', 3))
+    HYBRID_SEARCH_ENABLED = os.getenv('HYBRID_SEARCH_ENABLED', 'true').lower() == 'true'  # fuse BM25 with FAISS
+    RRF_K = int(os.getenv('RRF_K', 60))  # reciprocal-rank fusion constant
+    BM25_K1 = float(os.getenv('BM25_K1', 1.2))
+    BM25_B = float(os.getenv('BM25_B', 0.75))
+    # Answer from BM25 alone when its confidence (0-1) is this high, or while embeddings are slow/failing
+    LEXICAL_FAST_PATH_ENABLED = os.getenv('LEXICAL_FAST_PATH_ENABLED', 'false').lower() == 'true'
+    LEXICAL_CONFIDENCE = float(os.getenv('LEXICAL_CONFIDENCE', 0.75))
+    EMBEDDING_SLOW_MS = float(os.getenv('EMBEDDING_SLOW_MS', 1500))  # moving average of uncached embedding calls
+    RETRIEVAL_OVERFETCH = int(os.getenv('RETRIEVAL_OVERFETCH', 4))  # search TOP_K * this, then dedupe/diversify
+    MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', 0.7))  # 1.0 = pure relevance, 0.0 = pure diversity
+    NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.95))  # cosine similarity
+    # Tokens of excerpts in the system prompt; by default room for TOP_K_RESULTS full chunks at ~1.8 tokens per word
+    CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', TOP_K_RESULTS * CHUNK_SIZE * 9 // 5))
+    REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', 20))  # per chat message; 0 disables
+    EMBEDDING_TIMEOUT_SECONDS = float(os.getenv('EMBEDDING_TIMEOUT_SECONDS', 10))  # per embeddings request, ingest included
+    CHAT_TIMEOUT_SECONDS = float(os.getenv('CHAT_TIMEOUT_SECONDS', 15))  # per completion; per read when streaming
+    OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 0))  # SDK-internal retries, which ignore deadlines
+    CHAT_MAX_RETRIES = int(os.getenv('CHAT_MAX_RETRIES', 2))  # our own retries, within the deadline
+    # Send a duplicate embeddings request once the first has run longer than this percentile of recent calls
+    EMBEDDING_HEDGE_ENABLED = os.getenv('EMBEDDING_HEDGE_ENABLED', 'true').lower() == 'true'
+    EMBEDDING_HEDGE_PERCENTILE = float(os.getenv('EMBEDDING_HEDGE_PERCENTILE', 95))
+    EMBEDDING_HEDGE_MIN_MS = float(os.getenv('EMBEDDING_HEDGE_MIN_MS', 50))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))  # consecutive failures; 0 disables
+    CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', 30))  # open time before a trial call
     DATABASE_PATH = os.getenv('DATABASE_PATH', 'database.db')
+    WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'false').lower() == 'true'
+    WRITE_BEHIND_FLUSH_MS = float(os.getenv('WRITE_BEHIND_FLUSH_MS', 50))
+    WRITE_BEHIND_MAX_BATCH = int(os.getenv('WRITE_BEHIND_MAX_BATCH', 256))
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 8))  # parallel completions per batch request
+    BATCH_QUERY_SIZE = int(os.getenv('BATCH_QUERY_SIZE', 100))  # queries embedded and searched together
+    BATCH_DEADLINE_SECONDS = float(os.getenv('BATCH_DEADLINE_SECONDS', 300))  # per retrieval batch; 0 disables
+    BATCH_MAX_QUERIES = int(os.getenv('BATCH_MAX_QUERIES', 5000))
+    MESSAGE_PAGE_SIZE = int(os.getenv('MESSAGE_PAGE_SIZE', 50))
+    CHAT_LIST_PAGE_SIZE = int(os.getenv('CHAT_LIST_PAGE_SIZE', 50))
+    HISTORY_SEARCH_PAGE_SIZE = int(os.getenv('HISTORY_SEARCH_PAGE_SIZE', 20))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_STATEMENT_CACHE_SIZE = int(os.getenv('SQLITE_STATEMENT_CACHE_SIZE', 256))
+    EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+    EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'embedding_cache.db')
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 50000))
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+    RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 3600))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 2000))
+    RESPONSE_CACHE_SEMANTIC = os.getenv('RESPONSE_CACHE_SEMANTIC', 'false').lower() == 'true'
+    RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', 0.97))
+    PROFILE_CACHE_MAX_ENTRIES = int(os.getenv('PROFILE_CACHE_MAX_ENTRIES', 10000))
+    PROFILE_CACHE_TTL_SECONDS = float(os.getenv('PROFILE_CACHE_TTL_SECONDS', 300))
+    PROFILE_CACHE_CHECK_INTERVAL = float(os.getenv('PROFILE_CACHE_CHECK_INTERVAL', 1))  # seconds between cross-worker checks
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))  # cost factor; older hashes are upgraded on login
+    BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', 2))  # hashing processes (threads outside gunicorn) per app worker
+    BCRYPT_MAX_PENDING = int(os.getenv('BCRYPT_MAX_PENDING', 8))  # queued + running hashes before rejecting
+    BCRYPT_TIMEOUT_SECONDS = float(os.getenv('BCRYPT_TIMEOUT_SECONDS', 10))
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'  # serve /metrics
+    SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 5000))  # log stage breakdown above this; 0 disables
+    SLOW_REQUEST_LOG = os.getenv('SLOW_REQUEST_LOG', '')  # file for the slow-request log; default is stderr
     SYSTEM_PROMPT = """You are a friendly and factual academic assistant. 
     Use the provided student guide content to answer questions accurately. 
     If you don't know the answer, say you don't know rather than making something up."""
\ No newline at end of file
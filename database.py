@@ -1,19 +1,65 @@
+import argparse
+import atexit
+import os
+import re
 import sqlite3
+import sys
+import threading
+from datetime import datetime, timezone
 from sqlite3 import Connection
 from config import Config
-from typing import Dict, List, Optional
+from metrics import sqlite_timed
+from typing import Dict, List, Optional, Tuple
 
-def get_db_connection() -> Connection:
-    """Create and return a database connection."""
-    conn = sqlite3.connect(Config.DATABASE_PATH)
+_local = threading.local()
+
+class PooledConnection(sqlite3.Connection):
+    """Connection reused by every query on a thread; close() is a no-op so callers can't tear it down."""
+
+    def close(self):
+        pass
+
+    def really_close(self):
+        super().close()
+
+def _connect() -> Connection:
+    conn = sqlite3.connect(
+        Config.DATABASE_PATH,
+        timeout=Config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=Config.SQLITE_STATEMENT_CACHE_SIZE,
+        factory=PooledConnection
+    )
     conn.row_factory = sqlite3.Row  # Access columns by name
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={int(Config.SQLITE_BUSY_TIMEOUT_MS)}')
+    conn.execute(f'PRAGMA mmap_size={int(Config.SQLITE_MMAP_SIZE)}')
+    conn.execute('PRAGMA temp_store=MEMORY')
     return conn
 
-def init_db():
-    """Initialize the database with required tables."""
-    conn = get_db_connection()
-    
-    # Create Users table
+def get_db_connection() -> Connection:
+    """Return this thread's pooled connection, opening it on first use.
+
+    Use it as ``with get_db_connection() as conn:`` to commit (or roll back)
+    a transaction; the connection itself stays open for the next query.
+    Connections are per process as well as per thread, so forked workers
+    never share one.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+def close_db_connection():
+    """Close this thread's pooled connection, if any."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.really_close()
+    _local.conn = None
+
+def _create_core_tables(conn: Connection):
     conn.execute('''
         CREATE TABLE IF NOT EXISTS Users (
             user_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -22,8 +68,6 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    # Create Chats table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS Chats (
             chat_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -32,8 +76,6 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES Users (user_id)
         )
     ''')
-    
-    # Create Messages table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS Messages (
             message_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -47,103 +89,512 @@ def init_db():
         )
     ''')
 
+def _add_profile_columns(conn: Connection):
+    existing = {row['name'] for row in conn.execute('PRAGMA table_info(Users)')}
+    for column, definition in [
+        ('language', 'TEXT DEFAULT "english"'),
+        ('tone', 'TEXT DEFAULT "warm"'),
+        ('persona_type', 'TEXT DEFAULT "predefined"'),
+        ('persona_key', 'TEXT DEFAULT "peer_mentor"'),
+        ('custom_persona', 'TEXT DEFAULT ""'),
+        ('explanation_style', 'TEXT DEFAULT "detailed"'),
+    ]:
+        if column not in existing:
+            conn.execute(f'ALTER TABLE Users ADD COLUMN {column} {definition}')
+
+def _create_app_state(conn: Connection):
+    # Counters other workers poll to notice changes, e.g. profile_generation
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS AppState (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO AppState (key, value) VALUES ('profile_generation', 0)")
+
+def _create_history_indexes(conn: Connection):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_chat_message ON Messages (chat_id, message_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chats_user_created ON Chats (user_id, created_at)')
+
+def _create_message_search(conn: Connection):
+    # External-content FTS5 index: stores only the index, reading text from Messages by rowid.
+    conn.execute('''
+        CREATE VIRTUAL TABLE MessagesFts USING fts5(
+            content,
+            content='Messages',
+            content_rowid='message_id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER messages_fts_insert AFTER INSERT ON Messages BEGIN
+            INSERT INTO MessagesFts (rowid, content) VALUES (new.message_id, new.content);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER messages_fts_delete AFTER DELETE ON Messages BEGIN
+            INSERT INTO MessagesFts (MessagesFts, rowid, content) VALUES ('delete', old.message_id, old.content);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON Messages BEGIN
+            INSERT INTO MessagesFts (MessagesFts, rowid, content) VALUES ('delete', old.message_id, old.content);
+            INSERT INTO MessagesFts (rowid, content) VALUES (new.message_id, new.content);
+        END
+    ''')
+
+def _backfill_message_search(conn: Connection):
+    conn.execute("INSERT INTO MessagesFts (MessagesFts) VALUES ('rebuild')")
+
+def _index_message_owner(conn: Connection):
+    # Index user_id alongside content so a search is restricted to one user inside the MATCH,
+    # ranking only that user's messages instead of every user's matches.
+    for trigger in ('messages_fts_insert', 'messages_fts_delete', 'messages_fts_update'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    conn.execute('DROP TABLE IF EXISTS MessagesFts')
+    conn.execute('''
+        CREATE VIRTUAL TABLE MessagesFts USING fts5(
+            content,
+            user_id,
+            content='Messages',
+            content_rowid='message_id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER messages_fts_insert AFTER INSERT ON Messages BEGIN
+            INSERT INTO MessagesFts (rowid, content, user_id) VALUES (new.message_id, new.content, new.user_id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER messages_fts_delete AFTER DELETE ON Messages BEGIN
+            INSERT INTO MessagesFts (MessagesFts, rowid, content, user_id)
+            VALUES ('delete', old.message_id, old.content, old.user_id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER messages_fts_update AFTER UPDATE OF content, user_id ON Messages BEGIN
+            INSERT INTO MessagesFts (MessagesFts, rowid, content, user_id)
+            VALUES ('delete', old.message_id, old.content, old.user_id);
+            INSERT INTO MessagesFts (rowid, content, user_id) VALUES (new.message_id, new.content, new.user_id);
+        END
+    ''')
+    conn.execute("INSERT INTO MessagesFts (MessagesFts) VALUES ('rebuild')")
+
+# Ordered schema changes; append new ones, never edit or reorder applied ones. The first four
+# are idempotent so databases created before schema_version existed are adopted as-is.
+MIGRATIONS = [
+    (1, 'Create Users, Chats and Messages', _create_core_tables),
+    (2, 'Add profile columns to Users', _add_profile_columns),
+    (3, 'Create AppState counters', _create_app_state),
+    (4, 'Index messages by chat and chats by user', _create_history_indexes),
+    (5, 'Create MessagesFts full-text index with sync triggers', _create_message_search),
+    (6, 'Backfill MessagesFts from existing messages', _backfill_message_search),
+    (7, 'Index message owners in MessagesFts for per-user search', _index_message_owner),
+]
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _applied_versions(conn: Connection) -> set:
+    try:
+        return {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+    except sqlite3.OperationalError:  # no schema_version table yet
+        return set()
+
+def applied_migrations() -> set:
+    """Versions of the migrations applied to the database."""
+    conn = _connect()
+    try:
+        return _applied_versions(conn)
+    finally:
+        conn.really_close()
+
+def schema_version() -> int:
+    """Highest migration applied to the database, 0 if none."""
+    return max(applied_migrations(), default=0)
+
+def check_schema():
+    """Fail fast when the database is behind this code, rather than on the first query."""
+    version = schema_version()
+    if version < LATEST_SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database {Config.DATABASE_PATH} is at schema version {version}, this code needs "
+            f"{LATEST_SCHEMA_VERSION}; run `python database.py migrate`"
+        )
+
+def migrate(target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to target (default: all), each in its own transaction.
+
+    Safe to run from several processes at once: each migration takes the
+    write lock and re-checks whether another process applied it meanwhile.
+    Returns the versions this call applied.
+    """
+    conn = _connect()
+    conn.isolation_level = None  # explicit BEGIN/COMMIT below
+    applied = []
     try:
-        conn.execute('ALTER TABLE Users ADD COLUMN language TEXT DEFAULT "english"')
-        conn.execute('ALTER TABLE Users ADD COLUMN tone TEXT DEFAULT "warm"')
-        conn.execute('ALTER TABLE Users ADD COLUMN persona_type TEXT DEFAULT "predefined"')
-        conn.execute('ALTER TABLE Users ADD COLUMN persona_key TEXT DEFAULT "peer_mentor"')
-        conn.execute('ALTER TABLE Users ADD COLUMN custom_persona TEXT DEFAULT ""')
-        conn.execute('ALTER TABLE Users ADD COLUMN explanation_style TEXT DEFAULT "detailed"')
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass 
-    
-    conn.commit()
-    conn.close()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        for version, description, apply in MIGRATIONS:
+            if target is not None and version > target:
+                break
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if version not in _applied_versions(conn):
+                    apply(conn)
+                    conn.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                        (version, description)
+                    )
+                    applied.append(version)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+    finally:
+        conn.really_close()
+    return applied
 
+@sqlite_timed
 def add_user(username: str, password_hash: str) -> int:
     """Add a new user to the database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO Users (username, password_hash) VALUES (?, ?)",
-        (username, password_hash)
-    )
-    user_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return user_id
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            "INSERT INTO Users (username, password_hash) VALUES (?, ?)",
+            (username, password_hash)
+        )
+    return cursor.lastrowid
 
+@sqlite_timed
 def verify_user(username: str, password_hash: str) -> Optional[Dict]:
     """Verify user credentials."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
+    user = get_db_connection().execute(
         "SELECT user_id, username FROM Users WHERE username = ? AND password_hash = ?",
         (username, password_hash)
-    )
-    user = cursor.fetchone()
-    conn.close()
+    ).fetchone()
+    return dict(user) if user else None
+
+@sqlite_timed
+def get_user(user_id: int) -> Optional[Dict]:
+    """Get a user's full row, including profile settings."""
+    user = get_db_connection().execute(
+        "SELECT * FROM Users WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
+    return dict(user) if user else None
+
+@sqlite_timed
+def get_user_profile(user_id: int) -> Optional[Dict]:
+    """Get the profile fields that shape a user's prompts."""
+    user = get_db_connection().execute(
+        "SELECT language, tone, persona_type, persona_key, custom_persona, explanation_style "
+        "FROM Users WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
     return dict(user) if user else None
 
+@sqlite_timed
+def get_profile_generation() -> int:
+    """Counter bumped on every profile update, so other workers know to drop cached profiles."""
+    row = get_db_connection().execute(
+        "SELECT value FROM AppState WHERE key = 'profile_generation'"
+    ).fetchone()
+    return row['value'] if row else 0
+
+def bump_profile_generation(conn: Connection):
+    """Bump the profile generation inside the caller's transaction."""
+    conn.execute("UPDATE AppState SET value = value + 1 WHERE key = 'profile_generation'")
+
+@sqlite_timed
 def create_new_chat(user_id: int) -> int:
     """Create a new chat session for a user."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO Chats (user_id) VALUES (?)",
-        (user_id,)
-    )
-    chat_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return chat_id
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            "INSERT INTO Chats (user_id) VALUES (?)",
+            (user_id,)
+        )
+    return cursor.lastrowid
 
+@sqlite_timed
 def get_user_chats(user_id: int) -> List[Dict]:
     """Get all chat sessions for a user."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
+    rows = get_db_connection().execute(
         "SELECT chat_id, created_at FROM Chats WHERE user_id = ? ORDER BY created_at DESC",
         (user_id,)
-    )
-    chats = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return chats
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+@sqlite_timed
+def get_user_chats_page(user_id: int, before: Optional[Tuple[str, int]] = None,
+                        limit: int = 50) -> Tuple[List[Dict], Optional[Tuple[str, int]]]:
+    """Get one page of a user's chats, newest first.
+
+    ``before`` is the (created_at, chat_id) cursor returned by the previous
+    page; the second return value is the cursor for the next page, or None.
+    """
+    if before is None:
+        rows = get_db_connection().execute(
+            "SELECT chat_id, created_at FROM Chats WHERE user_id = ? "
+            "ORDER BY created_at DESC, chat_id DESC LIMIT ?",
+            (user_id, limit + 1)
+        ).fetchall()
+    else:
+        created_at, chat_id = before
+        rows = get_db_connection().execute(
+            "SELECT chat_id, created_at FROM Chats WHERE user_id = ? "
+            "AND (created_at < ? OR (created_at = ? AND chat_id < ?)) "
+            "ORDER BY created_at DESC, chat_id DESC LIMIT ?",
+            (user_id, created_at, created_at, chat_id, limit + 1)
+        ).fetchall()
+    chats = [dict(row) for row in rows[:limit]]
+    next_cursor = (chats[-1]['created_at'], chats[-1]['chat_id']) if len(rows) > limit else None
+    return chats, next_cursor
 
+@sqlite_timed
 def get_chat_messages(chat_id: int) -> List[Dict]:
-    """Get all messages for a chat session."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT message_id, role, content, timestamp FROM Messages WHERE chat_id = ? ORDER BY timestamp ASC",
-        (chat_id,)
-    )
-    messages = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return messages
+    """Get all messages for a chat session, including ones not yet written behind."""
+    def read():
+        return get_db_connection().execute(
+            "SELECT message_id, role, content, timestamp FROM Messages WHERE chat_id = ? ORDER BY message_id ASC",
+            (chat_id,)
+        ).fetchall()
+    rows, pending = message_writer.read_with_pending(chat_id, read)
+    return [dict(row) for row in rows] + pending
+
+@sqlite_timed
+def get_chat_messages_page(chat_id: int, user_id: int, before_id: Optional[int] = None,
+                           limit: int = 50) -> Tuple[List[Dict], Optional[int]]:
+    """Get the newest messages of a chat older than ``before_id``, in chronological order.
+
+    Only returns messages of chats owned by ``user_id``. The second return
+    value is the ``before_id`` for loading the next older page, or None.
+    The newest page also includes messages not yet written behind; they
+    take the newest slots, and the cursor continues from the oldest
+    persisted message kept (or the newest one, if none fit).
+    """
+    def read():
+        return get_db_connection().execute(
+            "SELECT message_id, role, content, timestamp FROM Messages "
+            "WHERE chat_id = ? AND user_id = ? AND message_id < ? "
+            "ORDER BY message_id DESC LIMIT ?",
+            (chat_id, user_id, before_id if before_id is not None else sys.maxsize, limit + 1)
+        ).fetchall()
+    rows, pending = message_writer.read_with_pending(chat_id, read)
+    persisted = [dict(row) for row in rows][::-1]  # up to limit + 1, oldest first
+    pending = [m for m in pending if m['user_id'] == user_id][-limit:] if before_id is None else []
+    kept = persisted[len(persisted) - (limit - len(pending)):] if len(pending) < limit else []
+    next_before_id = None
+    if len(persisted) > len(kept):
+        next_before_id = kept[0]['message_id'] if kept else persisted[-1]['message_id'] + 1
+    return kept + pending, next_before_id
+
+# Wrapped around matched terms in search snippets; the caller escapes the text and swaps them for markup.
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+def fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix.
 
+    Words are quoted, so FTS5 operators and punctuation in the input can't
+    cause syntax errors. Returns '' when there is nothing to search for.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return ''
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+@sqlite_timed
+def search_messages(user_id: int, query: str, offset: int = 0,
+                    limit: int = 20) -> Tuple[List[Dict], Optional[int]]:
+    """Full-text search over a user's messages, best match first.
+
+    The user is matched inside the FTS query (MessagesFts indexes user_id),
+    so only their messages are gathered and ranked. Each result has the
+    message's chat_id, role and timestamp and a snippet with matched terms
+    between HIGHLIGHT_START and HIGHLIGHT_END. The second return value is
+    the offset of the next page, or None. Messages still queued for
+    write-behind are not searchable until flushed.
+    """
+    match = fts_query(query)
+    if not match:
+        return [], None
+    rows = get_db_connection().execute(
+        "SELECT m.message_id, m.chat_id, m.role, m.timestamp, "
+        "snippet(MessagesFts, 0, ?, ?, '…', 16) AS snippet "
+        "FROM MessagesFts JOIN Messages m ON m.message_id = MessagesFts.rowid "
+        "WHERE MessagesFts MATCH ? AND m.user_id = ? "
+        "ORDER BY bm25(MessagesFts, 1.0, 0.0), m.message_id DESC LIMIT ? OFFSET ?",
+        (HIGHLIGHT_START, HIGHLIGHT_END, f'user_id : "{int(user_id)}" AND content : ({match})', user_id,
+         limit + 1, offset)
+    ).fetchall()
+    results = [dict(row) for row in rows[:limit]]
+    return results, offset + limit if len(rows) > limit else None
+
+@sqlite_timed
 def get_recent_messages(chat_id: int, limit: int = 5) -> List[Dict]:
     """Get recent messages for a chat session."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT role, content FROM Messages WHERE chat_id = ? ORDER BY timestamp DESC LIMIT ?",
-        (chat_id, limit)
-    )
-    messages = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return messages[::-1]  # Reverse to maintain chronological order
+    def read():
+        return get_db_connection().execute(
+            "SELECT role, content FROM Messages WHERE chat_id = ? ORDER BY message_id DESC LIMIT ?",
+            (chat_id, limit)
+        ).fetchall()
+    rows, pending = message_writer.read_with_pending(chat_id, read)
+    messages = [dict(row) for row in rows]
+    messages = messages[::-1]  # Reverse to maintain chronological order
+    messages += [{'role': m['role'], 'content': m['content']} for m in pending]
+    return messages[-limit:]
+
+_INSERT_MESSAGES = "INSERT INTO Messages (chat_id, user_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)"
+
+@sqlite_timed
+def _insert_messages(rows: List[Tuple]):
+    with get_db_connection() as conn:
+        conn.executemany(_INSERT_MESSAGES, rows)
+
+def add_messages(messages: List[Tuple[int, int, str, str]]):
+    """Persist (chat_id, user_id, role, content) messages in one transaction.
+
+    With write-behind enabled they are queued and group-committed with other
+    requests' messages instead; reads in this process still see them.
+    """
+    now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    rows = [(chat_id, user_id, role, content, now) for chat_id, user_id, role, content in messages]
+    if Config.WRITE_BEHIND_ENABLED:
+        message_writer.enqueue(rows)
+    else:
+        _insert_messages(rows)
 
 def add_message_to_chat(chat_id: int, user_id: int, role: str, content: str):
     """Add a message to a chat session."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO Messages (chat_id, user_id, role, content) VALUES (?, ?, ?, ?)",
-        (chat_id, user_id, role, content)
-    )
-    conn.commit()
-    conn.close()
+    add_messages([(chat_id, user_id, role, content)])
+
+def add_chat_turn(chat_id: int, user_id: int, user_message: str, assistant_message: Optional[str]):
+    """Persist a user message and the assistant's reply atomically."""
+    messages = [(chat_id, user_id, 'user', user_message)]
+    if assistant_message:
+        messages.append((chat_id, user_id, 'assistant', assistant_message))
+    add_messages(messages)
+
+class MessageWriter:
+    """Write-behind queue that group-commits messages from concurrent requests.
+
+    A background thread flushes every WRITE_BEHIND_FLUSH_MS, or sooner once
+    WRITE_BEHIND_MAX_BATCH messages are queued, and the queue is flushed at
+    interpreter exit. Unflushed messages are only visible within this process.
+    """
+
+    def __init__(self, flush_interval: float, max_batch: int):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queued: List[Tuple] = []
+        self._flushing: List[Tuple] = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._commit_lock = threading.Lock()  # readers vs. the insert and commit of a flush
+        self._thread = None
+        self._pid = None
+
+    def enqueue(self, rows: List[Tuple]):
+        with self._cond:
+            self._ensure_thread()
+            self._queued.extend(rows)
+            if len(self._queued) >= self.max_batch:
+                self._cond.notify()
+
+    def _ensure_thread(self):
+        # A forked worker inherits the queue object but not the thread.
+        if self._pid != os.getpid():
+            self._queued = []
+            self._flushing = []
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._queued) >= self.max_batch, timeout=self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Write-behind flush failed, will retry: {e}")
+
+    def flush(self):
+        """Commit everything queued so far in one transaction.
+
+        The batch stays visible to read_with_pending until it commits. Readers
+        only wait for the insert and commit themselves: the write lock is
+        taken first, so waiting out SQLite's busy timeout blocks no one.
+        """
+        with self._flush_lock:
+            with self._cond:
+                self._flushing, self._queued = self._queued, []
+            if not self._flushing:
+                return
+            try:
+                self._write_batch(self._flushing)
+            except BaseException:
+                with self._cond:
+                    self._queued[:0] = self._flushing
+                    self._flushing = []
+                raise
+
+    @sqlite_timed
+    def _write_batch(self, rows: List[Tuple]):
+        conn = get_db_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            with self._commit_lock:
+                conn.executemany(_INSERT_MESSAGES, rows)
+                conn.commit()
+                with self._cond:
+                    self._flushing = []
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def read_with_pending(self, chat_id: int, read):
+        """Run a read and collect this chat's unflushed messages consistently with it."""
+        if self._pid != os.getpid():
+            return read(), []
+        with self._commit_lock:
+            rows = read()
+            with self._cond:
+                pending = [row for row in self._flushing + self._queued if row[0] == chat_id]
+        return rows, [
+            {'message_id': None, 'chat_id': row[0], 'user_id': row[1], 'role': row[2],
+             'content': row[3], 'timestamp': row[4]}
+            for row in pending
+        ]
+
+message_writer = MessageWriter(
+    flush_interval=Config.WRITE_BEHIND_FLUSH_MS / 1000,
+    max_batch=Config.WRITE_BEHIND_MAX_BATCH
+)
+# atexit runs handlers in reverse, so the final flush happens before its connection is closed.
+atexit.register(close_db_connection)
+atexit.register(message_writer.flush)
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply or inspect database schema migrations.")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subcommands.add_parser('migrate', help="apply pending migrations")
+    migrate_parser.add_argument('--to', type=int, help="stop after this version")
+    subcommands.add_parser('status', help="show applied and pending migrations")
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        applied = migrate(args.to)
+        print(f"Applied migrations {applied}" if applied else "No pending migrations")
+    applied = applied_migrations()
+    print(f"{Config.DATABASE_PATH}: schema version {max(applied, default=0)} (latest {LATEST_SCHEMA_VERSION})")
+    if args.command == 'status':
+        for version, description, _ in MIGRATIONS:
+            print(f"  {'applied' if version in applied else 'pending'} {version:3d} {description}")
 
-init_db()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
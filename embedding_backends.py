@@ -0,0 +1,126 @@
+"""Embedding backends selected by Config.EMBEDDING_MODEL.
+
+A plain model name (e.g. ``text-embedding-3-small``) uses the OpenAI API.
+A ``local:`` prefix (e.g. ``local:sentence-transformers/all-MiniLM-L6-v2``)
+runs a sentence-transformers model on the CPU inside the worker process.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import openai
+
+from config import Config
+from upstream import Deadline, with_retries
+
+LOCAL_PREFIX = 'local:'
+
+OPENAI_DIMENSIONS = {
+    'text-embedding-3-small': 1536,
+    'text-embedding-3-large': 3072,
+    'text-embedding-ada-002': 1536,
+}
+
+class OpenAIEmbeddingBackend:
+    name = 'openai'
+    remote = True  # worth hedging
+
+    def __init__(self, model: str):
+        self.model = model
+        self.dimension: Optional[int] = OPENAI_DIMENSIONS.get(model)
+
+    def embed(self, texts: List[str], deadline: Optional[Deadline] = None) -> List[List[float]]:
+        """Embed texts using batched, concurrent requests, all finished by the deadline if one is given."""
+        batch_size = Config.EMBEDDING_BATCH_SIZE
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0], deadline)
+        with ThreadPoolExecutor(max_workers=Config.EMBEDDING_CONCURRENCY) as executor:
+            results = executor.map(lambda batch: self._embed_batch(batch, deadline), batches)
+            return [embedding for batch in results for embedding in batch]
+
+    def _embed_batch(self, batch: List[str], deadline: Optional[Deadline] = None) -> List[List[float]]:
+        """Embed one batch, backing off on rate limits and transient errors while the deadline allows."""
+        response = with_retries(
+            lambda timeout: openai.embeddings.create(input=batch, model=self.model, timeout=timeout),
+            deadline, Config.EMBEDDING_TIMEOUT_SECONDS, Config.EMBEDDING_MAX_RETRIES
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+class SentenceTransformerBackend:
+    name = 'sentence-transformers'
+    remote = False
+
+    def __init__(self, model: str):
+        self.model = model
+        self._encoder = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._encoder is None:
+                import torch
+                from sentence_transformers import SentenceTransformer
+
+                if Config.EMBEDDING_THREADS:
+                    torch.set_num_threads(Config.EMBEDDING_THREADS)
+                self._encoder = SentenceTransformer(self.model, device='cpu')
+        return self._encoder
+
+    @property
+    def dimension(self) -> int:
+        return self._load().get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str], deadline: Optional[Deadline] = None) -> List[List[float]]:
+        # Runs on this worker's CPU: there is nothing to time out or hedge.
+        vectors = self._load().encode(
+            texts,
+            batch_size=Config.EMBEDDING_BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return vectors.astype('float32').tolist()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Process-wide backend for Config.EMBEDDING_MODEL; local models load once per worker."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            model = Config.EMBEDDING_MODEL
+            if model.startswith(LOCAL_PREFIX):
+                _backend = SentenceTransformerBackend(model[len(LOCAL_PREFIX):])
+            else:
+                _backend = OpenAIEmbeddingBackend(model)
+        return _backend
+
+
+def backend_info() -> Dict:
+    """What the index records about the backend that built it."""
+    backend = get_backend()
+    return {
+        'embedding_model': Config.EMBEDDING_MODEL,
+        'embedding_backend': backend.name,
+        'embedding_dimension': backend.dimension,
+    }
+
+
+def check_compatible(info: Dict, index_dimension: int):
+    """Fail fast if an index was built by a different backend or dimension than the configured one."""
+    expected = backend_info()
+    recorded_model = info.get('embedding_model')
+    if recorded_model and recorded_model != expected['embedding_model']:
+        raise RuntimeError(
+            f"Index was built with embedding model {recorded_model!r} but EMBEDDING_MODEL is "
+            f"{expected['embedding_model']!r}; re-run ingestion or change the configuration"
+        )
+    if expected['embedding_dimension'] and index_dimension != expected['embedding_dimension']:
+        raise RuntimeError(
+            f"Index dimension {index_dimension} does not match the {expected['embedding_backend']} "
+            f"backend's dimension {expected['embedding_dimension']}"
+        )
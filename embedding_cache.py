@@ -0,0 +1,147 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from config import Config
+from metrics import record_cache
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different inputs share a cache entry."""
+    return " ".join(unicodedata.normalize('NFKC', text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    """Cache key built from the model name and the normalized text hash."""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk embedding cache in SQLite with size-bounded LRU eviction."""
+
+    EVICT_EVERY = 256
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._init_schema()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)')
+        conn.commit()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, List[float]]:
+        """Return cached vectors for whichever of the texts are present, keyed by cache key."""
+        keys = list({cache_key(model, text) for text in texts})
+        found = {}
+        conn = self._connection()
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ", ".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            found.update((key, np.frombuffer(vector, dtype='float32').tolist()) for key, vector in rows)
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                             [(now, key) for key in found])
+            conn.commit()
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        """Store vectors for the given texts."""
+        now = time.time()
+        conn = self._connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+            [(cache_key(model, text), model, np.asarray(vector, dtype='float32').tobytes(), now)
+             for text, vector in items.items()]
+        )
+        conn.commit()
+        with self._lock:
+            self._writes += len(items)
+            should_evict = self._writes >= self.EVICT_EVERY
+            if should_evict:
+                self._writes = 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries beyond max_entries."""
+        conn = self._connection()
+        conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        conn.commit()
+
+    def get_or_compute(self, model: str, texts: List[str],
+                       compute: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Return embeddings for texts in order, computing and caching only the misses."""
+        cached = self.get_many(model, texts)
+        missing = {}
+        for text in texts:
+            key = cache_key(model, text)
+            if key not in cached:
+                missing.setdefault(key, text)
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        record_cache('embedding', len(texts) - len(missing), len(missing))
+
+        if missing:
+            computed = dict(zip(missing.values(), compute(list(missing.values()))))
+            self.put_many(model, computed)
+            cached.update((key, computed[text]) for key, text in missing.items())
+        return [cached[cache_key(model, text)] for text in texts]
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide cache instance, created on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(Config.EMBEDDING_CACHE_PATH, Config.EMBEDDING_CACHE_MAX_ENTRIES)
+        return _cache
@@ -0,0 +1,62 @@
+"""Gunicorn settings, picked up automatically by ``gunicorn app:app`` from this directory.
+
+Gives the workers a shared Prometheus multiprocess directory so /metrics
+reports the whole server, not just the worker that answered the scrape.
+
+By default the app is imported and the vector index loaded once in the
+master, and workers share those pages copy-on-write instead of each
+loading their own; set GUNICORN_PRELOAD=false to load per worker (e.g. to
+pick up code changes on HUP). A preloaded index version stays in use, and
+so on disk, until the master restarts even after workers reload a newer one.
+
+Workers are gthread workers with GUNICORN_THREADS threads each, and hash
+passwords in spawned processes (see password_hashing.py); other entry
+points, such as ``python app.py``, hash on threads. The hashing pool only
+keeps a worker responsive with more than one thread: a sync worker serves
+one request at a time, so a login storm would still queue at the worker.
+"""
+import os
+import shutil
+import tempfile
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+_owns_metrics_dir = 'PROMETHEUS_MULTIPROC_DIR' not in os.environ
+os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), f"study-assistant-metrics-{os.getpid()}")
+)
+
+
+def on_starting(server):
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    # Runs in the master before the first worker is forked.
+    if server.cfg.preload_app:
+        from chat_handler import chat_handler
+
+        chat_handler.preload()
+
+
+def post_fork(server, worker):
+    # Safe to spawn bcrypt processes here: their __main__ is gunicorn's guarded script, not the app.
+    from password_hashing import hasher
+
+    hasher.use_processes()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if _owns_metrics_dir:
+        shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
@@ -0,0 +1,126 @@
+"""Versioned vector store directories with atomic publishing.
+
+Layout under the vector store directory (dirname of Config.FAISS_INDEX_PATH):
+
+    versions/<version>/   faiss_index, chunk store, embeddings and manifest.json
+    CURRENT               name of the published version
+
+Publishing rewrites CURRENT with os.replace, so readers always see either the
+old or the new version. Every process serving a version holds a shared flock
+on its .lease file; a version is garbage-collected only once nobody does.
+A store without CURRENT is read from the legacy flat layout.
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Optional
+
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process leases, so never garbage-collect
+    fcntl = None
+
+VERSIONS_DIR = 'versions'
+CURRENT_NAME = 'CURRENT'
+LEASE_NAME = '.lease'
+MANIFEST_NAME = 'manifest.json'
+
+
+def base_dir() -> str:
+    return os.path.dirname(Config.FAISS_INDEX_PATH)
+
+
+def index_path(directory: str) -> str:
+    """Path of the FAISS index file inside a version (or legacy) directory."""
+    return os.path.join(directory, os.path.basename(Config.FAISS_INDEX_PATH))
+
+
+def read_manifest(directory: str) -> dict:
+    """Manifest written by ingestion, or an empty dict for stores that predate it."""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def current_version(root: str = None) -> Optional[str]:
+    try:
+        with open(os.path.join(root or base_dir(), CURRENT_NAME)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_dir(version: Optional[str], root: str = None) -> str:
+    root = root or base_dir()
+    return os.path.join(root, VERSIONS_DIR, version) if version else root
+
+
+def new_version_dir(root: str = None):
+    """Create an empty directory for the next version, leased so it survives garbage collection."""
+    version = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    path = version_dir(version, root)
+    os.makedirs(path)
+    return path, VersionLease(version, root)
+
+
+def publish(path: str, root: str = None):
+    """Atomically make the version at path the current one."""
+    root = root or base_dir()
+    pointer = os.path.join(root, CURRENT_NAME)
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(os.path.basename(path))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer + '.tmp', pointer)
+
+
+class VersionLease:
+    """Shared lock telling the garbage collector a version is still in use."""
+
+    def __init__(self, version: Optional[str], root: str = None):
+        self._fd = None
+        if fcntl is None or version is None:
+            return
+        self._fd = os.open(os.path.join(version_dir(version, root), LEASE_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def collect_garbage(root: str = None) -> int:
+    """Delete non-current versions that no process holds a lease on."""
+    if fcntl is None:
+        return 0
+    root = root or base_dir()
+    versions_root = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(versions_root):
+        return 0
+
+    current = current_version(root)
+    removed = 0
+    for version in os.listdir(versions_root):
+        if version == current:
+            continue
+        path = os.path.join(versions_root, version)
+        fd = os.open(os.path.join(path, LEASE_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            # Re-check: the version may have been published while we were looking.
+            if version != current_version(root):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        finally:
+            os.close(fd)
+    return removed
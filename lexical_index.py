@@ -0,0 +1,123 @@
+"""BM25 inverted index over the chunk store, written next to the FAISS index.
+
+Postings are stored term by term in ``bm25_postings.npy`` (chunk IDs) and
+``bm25_tf.npy`` (term frequencies), with each term's slice and document
+frequency in ``bm25_vocab.json``. The arrays are memory-mapped like the
+chunk store; k1 and b are read from Config at query time, so they can be
+tuned without re-ingesting.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+
+VOCAB_NAME = 'bm25_vocab.json'
+POSTINGS_NAME = 'bm25_postings.npy'
+TF_NAME = 'bm25_tf.npy'
+DOC_LENGTHS_NAME = 'bm25_doclen.npy'
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by can do does for from has have how i if in into is it its
+me my of on or our so than that the their them then there these they this to was we were
+what when where which who why will with you your
+""".split())
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def write(directory: str, texts: Iterable[str]):
+    """Build the index for texts (in chunk ID order) and write it to directory."""
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    doc_lengths = []
+    for doc_id, text in enumerate(texts):
+        tokens = tokenize(text)
+        doc_lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append((doc_id, tf))
+
+    terms = {}
+    ids, tfs = [], []
+    for term in sorted(postings):
+        entries = postings[term]
+        terms[term] = [len(ids), len(ids) + len(entries)]
+        ids.extend(doc_id for doc_id, _ in entries)
+        tfs.extend(tf for _, tf in entries)
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, POSTINGS_NAME), np.array(ids, dtype='int32'))
+    np.save(os.path.join(directory, TF_NAME), np.array(tfs, dtype='float32'))
+    np.save(os.path.join(directory, DOC_LENGTHS_NAME), np.array(doc_lengths, dtype='float32'))
+    with open(os.path.join(directory, VOCAB_NAME), 'w', encoding='utf-8') as f:
+        json.dump({
+            'documents': len(doc_lengths),
+            'average_length': sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0,
+            'terms': terms
+        }, f, ensure_ascii=False, separators=(',', ':'))
+
+
+class BM25Index:
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, VOCAB_NAME), encoding='utf-8') as f:
+            vocab = json.load(f)
+        self.documents = vocab['documents']
+        self.average_length = vocab['average_length'] or 1.0
+        self._terms = vocab['terms']
+        self._postings = np.load(os.path.join(directory, POSTINGS_NAME), mmap_mode='r')
+        self._tf = np.load(os.path.join(directory, TF_NAME), mmap_mode='r')
+        self._doc_lengths = np.load(os.path.join(directory, DOC_LENGTHS_NAME), mmap_mode='r')
+
+    def _idf(self, df: int) -> float:
+        return math.log(1 + (self.documents - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int,
+               ranges: Optional[List[Tuple[int, int]]] = None) -> Tuple[List[int], List[float], float]:
+        """Top k chunk IDs and scores for query, plus the confidence of the best match.
+
+        Confidence is the best score divided by the highest score any chunk
+        could reach for the query terms, so it falls in [0, 1). With ranges,
+        only chunk IDs inside those [start, end) ranges are returned.
+        """
+        k1, b = Config.BM25_K1, Config.BM25_B
+        scores = np.zeros(self.documents, dtype='float32')
+        ceiling = 0.0
+        for term in set(tokenize(query)):
+            span = self._terms.get(term)
+            if span is None:
+                continue
+            start, end = span
+            idf = self._idf(end - start)
+            ceiling += idf * (k1 + 1)
+            ids = self._postings[start:end]
+            tf = self._tf[start:end]
+            norm = k1 * (1 - b + b * self._doc_lengths[ids] / self.average_length)
+            scores[ids] += idf * tf * (k1 + 1) / (tf + norm)
+
+        if not ceiling:
+            return [], [], 0.0
+        if ranges is not None:
+            allowed = np.zeros(self.documents, dtype=bool)
+            for start, end in ranges:
+                allowed[start:end] = True
+            scores[~allowed] = 0
+        k = min(k, self.documents)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = top[scores[top] > 0]
+        return [int(i) for i in top], [float(scores[i]) for i in top], float(scores[top[0]]) / ceiling if len(top) else 0.0
+
+
+def load(directory: str) -> Optional[BM25Index]:
+    """Open the BM25 index in directory, or None for stores built before it existed."""
+    if not os.path.exists(os.path.join(directory, VOCAB_NAME)):
+        return None
+    return BM25Index(directory)
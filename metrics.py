@@ -0,0 +1,154 @@
+"""Prometheus metrics for the chat path and the slow-request log.
+
+Stages are timed with ``with stage('embedding'):``. Inside a request tracked
+by ``track_request`` the timings, token counts and SQLite time also add up
+on the request's trace, which is logged when the request is slower than
+SLOW_REQUEST_MS.
+
+Under gunicorn, gunicorn.conf.py sets PROMETHEUS_MULTIPROC_DIR before the
+app is imported, so every worker writes its samples there and /metrics
+aggregates all of them, whichever worker serves the scrape.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+from config import Config
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 20, 30, 60)
+
+REQUEST_SECONDS = Histogram(
+    'chat_request_seconds', "End-to-end time of /chat replies", ['mode'], buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram(
+    'chat_stage_seconds', "Time spent in each stage of answering a chat message", ['stage'],
+    buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter('llm_tokens', "Tokens sent to and received from the chat model", ['kind'])
+CACHE_LOOKUPS = Counter('cache_lookups', "Cache lookups by cache and result", ['cache', 'result'])
+UPSTREAM_EVENTS = Counter(
+    'upstream_events', "Timeouts, errors, hedges, circuit-breaker trips and fallbacks per upstream service",
+    ['service', 'event'])
+SQLITE_SECONDS = Histogram(
+    'sqlite_seconds', "Time spent in SQLite calls, including waiting for locks", ['operation'],
+    buckets=LATENCY_BUCKETS)
+
+slow_log = logging.getLogger('slow_requests')
+if Config.SLOW_REQUEST_LOG:
+    _handler = logging.FileHandler(Config.SLOW_REQUEST_LOG)
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(process)d %(message)s'))
+    slow_log.addHandler(_handler)
+    slow_log.setLevel(logging.WARNING)
+
+_local = threading.local()
+
+
+class RequestTrace:
+    """Per-request breakdown that ends up in the slow-request log."""
+
+    def __init__(self, mode: str, context: Dict):
+        self.mode = mode
+        self.context = context
+        self.stages: Dict[str, float] = {}
+        self.tokens: Dict[str, int] = {}
+        self.started = time.perf_counter()
+
+    def add(self, stage_name: str, seconds: float):
+        self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def track_request(mode: str, **context):
+    """Time a whole reply and log its stage breakdown if it is slow.
+
+    Thread-local rather than a contextvar so it also covers streamed replies,
+    whose generator is driven by the server after the view has returned.
+    """
+    trace = RequestTrace(mode, context)
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+        elapsed = time.perf_counter() - trace.started
+        REQUEST_SECONDS.labels(mode).observe(elapsed)
+        if Config.SLOW_REQUEST_MS and elapsed * 1000 >= Config.SLOW_REQUEST_MS:
+            slow_log.warning("Slow %s request: %s", mode, json.dumps({
+                **trace.context,
+                'total_ms': round(elapsed * 1000, 1),
+                'stages_ms': {name: round(seconds * 1000, 1) for name, seconds in trace.stages.items()},
+                'tokens': trace.tokens,
+            }))
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def observe_stage(name: str, seconds: float):
+    STAGE_SECONDS.labels(name).observe(seconds)
+    trace = current_trace()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def record_tokens(prompt_tokens: int, completion_tokens: int):
+    LLM_TOKENS.labels('prompt').inc(prompt_tokens)
+    LLM_TOKENS.labels('completion').inc(completion_tokens)
+    trace = current_trace()
+    if trace is not None:
+        trace.tokens['prompt'] = trace.tokens.get('prompt', 0) + prompt_tokens
+        trace.tokens['completion'] = trace.tokens.get('completion', 0) + completion_tokens
+
+
+def record_cache(cache: str, hits: int, misses: int = 0):
+    if hits:
+        CACHE_LOOKUPS.labels(cache, 'hit').inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(cache, 'miss').inc(misses)
+
+
+def record_upstream(service: str, event: str):
+    UPSTREAM_EVENTS.labels(service, event).inc()
+
+
+def sqlite_timed(function):
+    """Record the time a database function spends in SQLite, per function and on the current trace."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            SQLITE_SECONDS.labels(function.__name__).observe(elapsed)
+            trace = current_trace()
+            if trace is not None:
+                trace.add('sqlite', elapsed)
+    return wrapper
+
+
+def render() -> Tuple[bytes, str]:
+    """Current metrics in the Prometheus text format, aggregated across workers when multiprocess."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
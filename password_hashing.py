@@ -0,0 +1,103 @@
+"""bcrypt hashing on a small dedicated process pool.
+
+Each hash costs hundreds of milliseconds of CPU. Running them in a bounded
+pool caps how much CPU a burst of logins can take from chat requests, and
+once BCRYPT_MAX_PENDING hashes are queued or running, new ones are rejected
+immediately with HashingBusy instead of piling up. Request threads only wait
+on the result, so gthread workers keep serving other requests meanwhile.
+
+The pool is a thread pool unless use_processes() is called (gunicorn.conf.py
+does, in each worker). A spawned child re-imports ``__main__``: under
+gunicorn that is gunicorn's own guarded script, but under ``python app.py``
+it would be the whole app, and an unguarded script cannot start the pool at
+all. bcrypt releases the GIL, so the thread pool still hashes in parallel.
+"""
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from typing import Union
+
+import bcrypt
+
+from config import Config
+
+_COST_RE = re.compile(rb'^\$2[abxy]?\$(\d\d)\$')
+
+
+class HashingBusy(RuntimeError):
+    """Too many password hashes are already queued; the caller should ask the user to retry."""
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _check(password: bytes, password_hash: bytes) -> bool:
+    return bcrypt.checkpw(password, password_hash)
+
+
+def _as_bytes(value: Union[str, bytes]) -> bytes:
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_pending: int, timeout: float):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.processes = False
+        self._pool = None
+        self._pid = None
+
+    def use_processes(self):
+        """Hash in spawned processes; only call this where ``__main__`` is cheap and guarded, as under gunicorn."""
+        self.processes = True
+
+    def _get_pool(self) -> Executor:
+        # Created lazily in each gunicorn worker; spawned so children don't inherit the app's threads.
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                if self.processes:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                    )
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+                self._pid = os.getpid()
+            return self._pool
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy("Password hashing queue is full")
+        try:
+            future = self._get_pool().submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingBusy(f"Password hashing took longer than {self.timeout:g}s")
+
+    def hash(self, password: str, rounds: int = None) -> bytes:
+        return self._run(_hash, password.encode('utf-8'), rounds or Config.BCRYPT_ROUNDS)
+
+    def check(self, password: str, password_hash: Union[str, bytes]) -> bool:
+        return self._run(_check, password.encode('utf-8'), _as_bytes(password_hash))
+
+
+def needs_rehash(password_hash: Union[str, bytes]) -> bool:
+    """Whether a stored hash was made with a different cost than BCRYPT_ROUNDS."""
+    match = _COST_RE.match(_as_bytes(password_hash))
+    return match is None or int(match.group(1)) != Config.BCRYPT_ROUNDS
+
+
+hasher = PasswordHasher(
+    workers=Config.BCRYPT_WORKERS,
+    max_pending=Config.BCRYPT_MAX_PENDING,
+    timeout=Config.BCRYPT_TIMEOUT_SECONDS
+)
@@ -1,102 +1,470 @@
 import os
+import hashlib
+import itertools
+import json
+import multiprocessing
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 import fitz  # PyMuPDF
 from config import Config
+from embedding_backends import backend_info, get_backend
+from embedding_cache import get_embedding_cache
+from vector_index import build_index, index_info
 import openai
 import numpy as np
 import faiss
-import pickle
+import chunk_store
+import index_store
+import lexical_index
 from tqdm import tqdm
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 openai.api_key = Config.OPENAI_API_KEY
+if Config.OPENAI_BASE_URL:
+    openai.base_url = Config.OPENAI_BASE_URL.rstrip('/') + '/'
+
+MANIFEST_NAME = index_store.MANIFEST_NAME
+EMBEDDINGS_NAME = 'embeddings.npy'
+
+
+def file_sha256(path: str) -> str:
+    """Content hash of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    """Content hash of a chunk of text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def iter_pdf_pages(pdf_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """Lazily yield (page_number, text) for pages [start, end) of a PDF, numbered from 1."""
+    try:
+        with fitz.open(pdf_path) as doc:
+            for page_number in range(start, doc.page_count if end is None else min(end, doc.page_count)):
+                page_text = doc[page_number].get_text()
+                yield page_number + 1, page_text.encode('utf-8', errors='ignore').decode('utf-8')
+    except Exception as e:
+        print(f"Error reading {pdf_path}: {e}")
+
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract pages [start, end) of a PDF; runs in the extraction worker processes."""
+    return list(iter_pdf_pages(pdf_path, start, end))
+
+
+def chunk_pages(pages: Iterable[Tuple[int, str]], chunk_size: Optional[int] = None,
+                overlap: Optional[int] = None) -> Iterator[Dict]:
+    """Split (page_number, text) pages into chunks of chunk_size words, overlapping by overlap words.
+
+    Only the words of the chunk being built are held in memory. Each chunk
+    records the pages it starts and ends on and its character offsets in the
+    document text (the pages concatenated in order).
+    """
+    chunk_size = chunk_size or Config.CHUNK_SIZE
+    overlap = Config.CHUNK_OVERLAP if overlap is None else overlap
+    overlap = max(0, min(overlap, chunk_size - 1))
+
+    words = []  # (word, page_number, start_char, end_char)
+    fresh = 0  # words not already emitted as part of the previous chunk's overlap
+    offset = 0
+    for page_number, text in pages:
+        for match in re.finditer(r'\S+', text):
+            words.append((match.group(), page_number, offset + match.start(), offset + match.end()))
+            fresh += 1
+            if len(words) >= chunk_size:
+                yield _make_chunk(words)
+                words = words[len(words) - overlap:] if overlap else []
+                fresh = 0
+        offset += len(text)
+    if fresh:
+        yield _make_chunk(words)
+
+
+def _make_chunk(words: List[Tuple[str, int, int, int]]) -> Dict:
+    return {
+        'text': " ".join(word for word, _, _, _ in words),
+        'start_page': words[0][1],
+        'end_page': words[-1][1],
+        'start_char': words[0][2],
+        'end_char': words[-1][3],
+    }
+
+
+def chunking_info() -> Dict:
+    """Chunker settings recorded in the manifest; stored chunks are only reused if they match."""
+    return {'chunk_size': Config.CHUNK_SIZE, 'chunk_overlap': Config.CHUNK_OVERLAP, 'page_aware': True}
+
+
+def page_count(pdf_path: str) -> int:
+    try:
+        with fitz.open(pdf_path) as doc:
+            return doc.page_count
+    except Exception as e:
+        print(f"Error reading {pdf_path}: {e}")
+        return 0
+
+
+def manifest_path_for(index_path: str) -> str:
+    return os.path.join(os.path.dirname(index_path), MANIFEST_NAME)
+
+
+def embeddings_path_for(index_path: str) -> str:
+    return os.path.join(os.path.dirname(index_path), EMBEDDINGS_NAME)
+
 
 class PDFProcessor:
     def __init__(self):
         self.chunks = []
         self.metadata = []
         self.embeddings = []
+        self.documents = {}
+        self.known_vectors = {}
+        self.previous_documents = {}
+        self.embedded_count = 0
+        self.reused_count = 0
+
+    def load_previous(self, index_path: str) -> Dict:
+        """Load the last run's manifest, index and metadata so unchanged chunks can be reused."""
+        manifest_path = manifest_path_for(index_path)
+        if not all(os.path.exists(p) for p in (manifest_path, index_path)):
+            return {}
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        info = backend_info()
+        if any(manifest.get(key) != value for key, value in info.items()):
+            return {}
+        if manifest.get('chunking') != chunking_info():
+            return {}
+
+        try:
+            metadata = chunk_store.load(os.path.dirname(index_path))
+        except FileNotFoundError:
+            return {}
+        if os.path.exists(embeddings_path_for(index_path)):
+            vectors = np.load(embeddings_path_for(index_path))
+        else:
+            index = faiss.read_index(index_path)
+            vectors = index.reconstruct_n(0, index.ntotal)
+        if len(vectors) != len(metadata):
+            return {}
+
+        for entry, vector in zip(metadata, vectors):
+            if 'chunk_hash' not in entry:
+                return {}
+            self.known_vectors[entry['chunk_hash']] = vector
+            self.previous_documents.setdefault(entry['doc_hash'], []).append((entry, vector))
+        return manifest
     
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """Extract text with encoding handling"""
-        text = ""
-        try:
-            doc = fitz.open(pdf_path)
-            for page in doc:
-                page_text = page.get_text()
-                if page_text:
-                    text += page_text.encode('utf-8', errors='ignore').decode('utf-8')
-        except Exception as e:
-            print(f"Error reading {pdf_path}: {e}")
-        return text
-    
-    def chunk_text(self, text: str, chunk_size: int = 500) -> List[str]:
-        """Split text into chunks of approximately chunk_size tokens."""
-        words = text.split()
-        chunks = []
-        current_chunk = []
-        current_size = 0
-        
-        for word in words:
-            current_chunk.append(word)
-            current_size += 1
-            if current_size >= chunk_size:
-                chunks.append(" ".join(current_chunk))
-                current_chunk = []
-                current_size = 0
-        
-        if current_chunk:
-            chunks.append(" ".join(current_chunk))
-        
-        return chunks
-    
+        return "".join(text for _, text in iter_pdf_pages(pdf_path))
+
+    def chunk_pdf(self, pdf_path: str) -> Iterator[Dict]:
+        """Stream page-aware chunks of a PDF without loading the whole document."""
+        return chunk_pages(iter_pdf_pages(pdf_path))
+
     def get_embedding(self, text: str) -> List[float]:
         """Get embedding for a text chunk."""
-        response = openai.embeddings.create(
-            input=text,
-            model=Config.EMBEDDING_MODEL
-        )
-        return response.data[0].embedding
+        return self.get_embeddings([text])[0]
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Get embeddings for many chunks, consulting the embedding cache first."""
+        if not Config.EMBEDDING_CACHE_ENABLED:
+            return self._embed_uncached(texts)
+        return get_embedding_cache().get_or_compute(Config.EMBEDDING_MODEL, texts, self._embed_uncached)
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts with the configured backend (batched, concurrent API calls or local inference)."""
+        return get_backend().embed(texts)
     
-    def process_pdf(self, pdf_path: str):
-        """Process a single PDF file."""
+    def process_pdf(self, pdf_path: str, doc_hash: Optional[str] = None):
+        """Process a single PDF file, embedding only chunks not seen before."""
         filename = os.path.basename(pdf_path)
-        text = self.extract_text_from_pdf(pdf_path)
-        chunks = self.chunk_text(text)
-        
-        for i, chunk in enumerate(chunks):
-            embedding = self.get_embedding(chunk)
-            self.chunks.append(chunk)
-            self.metadata.append({
-                'text': chunk,
-                'source': filename,
-                'page': i // 5,
-                'chunk_index': i
-            })
-            self.embeddings.append(embedding)
+        doc_hash = doc_hash or file_sha256(pdf_path)
+        if not self.reuse_document(filename, doc_hash):
+            self.add_document(filename, doc_hash, self.chunk_pdf(pdf_path))
+
+    def reuse_document(self, filename: str, doc_hash: str) -> bool:
+        """Add a document unchanged since the last run from its stored chunks and vectors."""
+        previous = self.previous_documents.get(doc_hash)
+        if not previous:
+            return False
+        for entry, vector in previous:
+            self._add_chunk(dict(entry, source=filename), vector)
+        self.reused_count += len(previous)
+        self.documents[doc_hash] = {'source': filename, 'chunks': [entry['chunk_hash'] for entry, _ in previous]}
+        return True
+
+    def add_document(self, filename: str, doc_hash: str, chunks: Iterable[Dict]) -> int:
+        """Embed a document's chunks that have no known vector yet and add them all.
+
+        Chunks are consumed in groups of a few embedding batches, so a long
+        document is never held in memory twice. Returns the number of chunks.
+        """
+        group_size = Config.EMBEDDING_BATCH_SIZE * Config.EMBEDDING_CONCURRENCY
+        hashes = []
+        chunks = iter(chunks)
+        while True:
+            group = list(itertools.islice(chunks, group_size))
+            if not group:
+                break
+            group_hashes = [text_sha256(chunk['text']) for chunk in group]
+
+            missing = {}
+            for chunk, chunk_hash in zip(group, group_hashes):
+                if chunk_hash not in self.known_vectors:
+                    missing.setdefault(chunk_hash, chunk['text'])
+            if missing:
+                for chunk_hash, embedding in zip(missing, self.get_embeddings(list(missing.values()))):
+                    self.known_vectors[chunk_hash] = embedding
+            self.embedded_count += len(missing)
+            self.reused_count += len(group) - len(missing)
+
+            for chunk, chunk_hash in zip(group, group_hashes):
+                self._add_chunk({
+                    **chunk,
+                    'source': filename,
+                    'page': chunk['start_page'],
+                    'chunk_index': len(hashes),
+                    'chunk_hash': chunk_hash,
+                    'doc_hash': doc_hash
+                }, self.known_vectors[chunk_hash])
+                hashes.append(chunk_hash)
+        self.documents[doc_hash] = {'source': filename, 'chunks': hashes}
+        return len(hashes)
+
+    def _add_chunk(self, entry: Dict, embedding):
+        self.chunks.append(entry['text'])
+        self.metadata.append(entry)
+        self.embeddings.append(embedding)
     
     def save_to_faiss(self, output_path: str):
-        """Save embeddings to FAISS index and metadata to pickle."""
+        """Save embeddings to a FAISS index of Config.FAISS_INDEX_TYPE and metadata to the chunk store.
+
+        The raw vectors are kept alongside so later runs can reuse them and
+        rebuild any index type without lossy reconstruction. A BM25 index and
+        a source -> ID range table over the same chunk IDs are written for
+        hybrid and source-scoped retrieval.
+        """
         if not self.embeddings:
             raise ValueError("No embeddings to save")
         embeddings_array = np.array(self.embeddings).astype('float32')
-        dimension = embeddings_array.shape[1]
-        index = faiss.IndexFlatL2(dimension)
-        index.add(embeddings_array)
+        # Chunks are added document by document, so each source is a contiguous ID range.
+        index = build_index(embeddings_array, ids=np.arange(len(embeddings_array)))
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        faiss.write_index(index, output_path)
-        metadata_path = os.path.join(os.path.dirname(output_path), 'metadata.pkl')
-        with open(metadata_path, 'wb') as f:
-            pickle.dump(self.metadata, f)
+        # Replace rather than overwrite: serving workers may have the old file memory-mapped.
+        faiss.write_index(index, output_path + '.tmp')
+        os.replace(output_path + '.tmp', output_path)
+        np.save(embeddings_path_for(output_path), embeddings_array)
+        chunk_store.write(os.path.dirname(output_path), self.metadata)
+        chunk_store.write_sources(os.path.dirname(output_path), self.metadata)
+        lexical_index.write(os.path.dirname(output_path), self.chunks)
+
+    def save_manifest(self, output_path: str, files: Dict[str, str]):
+        """Record file and chunk hashes next to the index for the next incremental run."""
+        manifest = {
+            **backend_info(),
+            'chunking': chunking_info(),
+            'index': index_info(),
+            'files': files,
+            'documents': self.documents
+        }
+        tmp_path = manifest_path_for(output_path) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, manifest_path_for(output_path))
+
+class StageStats:
+    """Throughput of one ingestion stage: items handled over the seconds it was busy."""
+
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.seconds = 0.0
+
+    def summary(self) -> str:
+        rate = self.items / self.seconds if self.seconds else 0.0
+        return f"{self.name}: {self.items} {self.unit} in {self.seconds:.1f}s ({rate:.1f} {self.unit}/s)"
+
+
+class ExtractionPipeline:
+    """Extract and chunk PDFs in a process pool, feeding a bounded queue for the embedding stage.
+
+    Large files are split into page ranges so they spread across workers.
+    Documents come out of the queue in submission order, and their page
+    ranges are read lazily as the embedding stage chunks them. At most
+    2 * workers ranges are submitted but not yet consumed, so memory stays
+    bounded however long the documents are; when the embedding stage falls
+    behind, extraction pauses. Workers are spawned, so a script calling
+    ingest_pdfs needs an ``if __name__ == '__main__'`` guard.
+    """
 
-def ingest_pdfs(pdf_dir: str):
-    """Process all PDFs in a directory and create FAISS index."""
+    _DONE = object()
+
+    def __init__(self, processor: PDFProcessor, workers: int = 0, pages_per_task: int = 0, queue_size: int = 0):
+        self.processor = processor
+        self.workers = workers or Config.INGEST_WORKERS or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task or Config.INGEST_PAGES_PER_TASK
+        self.queue = queue.Queue(maxsize=queue_size or Config.INGEST_QUEUE_SIZE)
+        self.extract_stats = StageStats('extract', 'pages')
+        self.embed_stats = StageStats('embed', 'chunks')
+        self._stop = threading.Event()
+        self._slots = threading.Semaphore(2 * self.workers)  # page ranges submitted but not yet consumed
+
+    def run(self, documents: List[tuple]):
+        """Ingest (path, doc_hash) pairs into the processor."""
+        pages_bar = tqdm(total=0, desc="Extracting", unit="page", position=0)
+        chunks_bar = tqdm(total=0, desc="Embedding", unit="chunk", position=1)
+        producer = threading.Thread(target=self._produce, args=(documents, pages_bar), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                path, doc_hash, chunks = item
+                filename = os.path.basename(path)
+                started = time.perf_counter()
+                if chunks is None:
+                    self.processor.reuse_document(filename, doc_hash)
+                else:
+                    count = self.processor.add_document(filename, doc_hash, chunks)
+                    self.embed_stats.items += count
+                    self.embed_stats.seconds += time.perf_counter() - started
+                    chunks_bar.total += count
+                    chunks_bar.update(count)
+        finally:
+            self._stop.set()
+            producer.join()
+            pages_bar.close()
+            chunks_bar.close()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _acquire_slot(self) -> bool:
+        while not self._stop.is_set():
+            if self._slots.acquire(timeout=0.5):
+                return True
+        return False
+
+    def _produce(self, documents: List[tuple], pages_bar):
+        started = time.perf_counter()
+        ranges = None
+        try:
+            # Spawned, not forked: this thread runs beside the embedding threads, and forking a
+            # multithreaded process can leave children stuck on locks held at fork time.
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+                for path, doc_hash in documents:
+                    if doc_hash in self.processor.previous_documents:
+                        if not self._put((path, doc_hash, None)):
+                            break
+                        continue
+                    pages = page_count(path)
+                    pages_bar.total += pages
+                    pages_bar.refresh()
+                    # Queued before its ranges are submitted, so the consumer can free slots as it goes.
+                    ranges = queue.Queue()
+                    if not self._put((path, doc_hash, chunk_pages(self._consume(ranges, pages_bar)))):
+                        break
+                    for start in range(0, pages, self.pages_per_task):
+                        if not self._acquire_slot():
+                            break
+                        ranges.put(pool.submit(extract_page_range, path, start, start + self.pages_per_task))
+                    ranges.put(self._DONE)
+                    ranges = None
+                    if self._stop.is_set():
+                        break
+                if self._stop.is_set():
+                    pool.shutdown(cancel_futures=True)
+            self._put(self._DONE)
+        except BaseException as e:
+            if ranges is not None:
+                ranges.put(e)  # the consumer may be waiting on this document's next range
+            self._put(e)
+        finally:
+            self.extract_stats.seconds = time.perf_counter() - started
+
+    def _consume(self, ranges: queue.Queue, pages_bar) -> Iterator[Tuple[int, str]]:
+        """Yield one document's pages range by range, dropping each range once it is used."""
+        while True:
+            item = ranges.get()
+            if item is self._DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            pages = item.result()
+            item = None
+            self._slots.release()
+            self.extract_stats.items += len(pages)
+            pages_bar.update(len(pages))
+            yield from pages
+
+
+def ingest_pdfs(pdf_dir: str, full_rebuild: bool = False):
+    """Incrementally (re)build the FAISS index from all PDFs in a directory.
+
+    Unchanged files and chunks reuse their stored vectors, deleted files are
+    dropped, and byte-identical files are embedded once under a single source.
+    A change of FAISS index type or build parameters rebuilds the index from
+    the stored vectors even when no PDF changed.
+    New files are extracted in parallel processes while earlier ones are
+    being embedded. The result is written to a new version directory and
+    published atomically, so running workers pick it up without a restart.
+    """
     processor = PDFProcessor()
-    pdf_files = [f for f in os.listdir(pdf_dir) if f.endswith('.pdf')]
+    current_dir = index_store.version_dir(index_store.current_version())
+    previous_manifest = {} if full_rebuild else processor.load_previous(index_store.index_path(current_dir))
+    pdf_files = sorted(f for f in os.listdir(pdf_dir) if f.endswith('.pdf'))
 
-    for pdf_file in tqdm(pdf_files, desc="Processing PDFs"):
-        pdf_path = os.path.join(pdf_dir, pdf_file)
-        processor.process_pdf(pdf_path)
-    processor.save_to_faiss(Config.FAISS_INDEX_PATH)
-    
-    print(f"Processed {len(processor.chunks)} chunks from {len(pdf_files)} PDFs")
-    print(f"FAISS index saved to {Config.FAISS_INDEX_PATH}")
\ No newline at end of file
+    files = {f: file_sha256(os.path.join(pdf_dir, f)) for f in pdf_files}
+    unique_files = {}
+    for pdf_file in sorted(pdf_files, key=lambda name: (len(name), name)):
+        unique_files.setdefault(files[pdf_file], pdf_file)
+
+    if files == previous_manifest.get('files'):
+        if previous_manifest.get('index') == index_info():
+            print("No PDF changes since the last run; index is up to date")
+            return
+        # Every document is reused below, so this only rebuilds the index from the stored vectors.
+        print(f"Index settings changed to {index_info()}; rebuilding from stored embeddings")
+
+    pipeline = ExtractionPipeline(processor)
+    pipeline.run([
+        (os.path.join(pdf_dir, pdf_file), doc_hash)
+        for doc_hash, pdf_file in sorted(unique_files.items(), key=lambda item: item[1])
+    ])
+
+    output_dir, lease = index_store.new_version_dir()
+    try:
+        output_path = index_store.index_path(output_dir)
+        processor.save_to_faiss(output_path)
+        processor.save_manifest(output_path, files)
+        index_store.publish(output_dir)
+    finally:
+        lease.release()
+    removed = index_store.collect_garbage()
+
+    print(f"Processed {len(processor.chunks)} chunks from {len(unique_files)} unique PDFs "
+          f"({len(pdf_files) - len(unique_files)} duplicates skipped)")
+    print(f"Embedded {processor.embedded_count} new chunks, reused {processor.reused_count}")
+    print(f"{pipeline.extract_stats.summary()} with {pipeline.workers} workers; {pipeline.embed_stats.summary()}")
+    print(f"FAISS index published to {output_dir} ({removed} unused versions removed)")
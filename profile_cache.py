@@ -0,0 +1,90 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+from metrics import record_cache
+
+_caches = weakref.WeakSet()
+
+
+class ProfileCache:
+    """Bounded LRU/TTL cache of per-user prompt data, invalidated across workers.
+
+    Updates in this process call invalidate_profile directly. Other workers
+    notice through the profile_generation counter in SQLite, which is checked
+    at most every check_interval seconds and clears the cache when it moves.
+    """
+
+    def __init__(self, loader: Callable[[int], Any], max_entries: int,
+                 ttl_seconds: float, check_interval: float):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (expires_at, value)
+        self._generation = None
+        self._epoch = 0  # bumped on every invalidation so in-flight loads don't store stale data
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def get(self, user_id: int) -> Any:
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._check_generation(now)
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                record_cache('profile', 1)
+                return entry[1]
+            self.misses += 1
+            record_cache('profile', 0, 1)
+            epoch = self._epoch
+
+        value = self.loader(user_id)
+        with self._lock:
+            if epoch != self._epoch:
+                return value
+            self._entries[user_id] = (now + self.ttl_seconds, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def _check_generation(self, now: float):
+        from database import get_profile_generation
+
+        self._next_check = now + self.check_interval
+        generation = get_profile_generation()
+        with self._lock:
+            if generation != self._generation:
+                self._entries.clear()
+                self._epoch += 1
+                self._generation = generation
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._epoch += 1
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+def invalidate_profile(user_id: int):
+    """Drop a user's cached profile from every cache in this process."""
+    for cache in list(_caches):
+        cache.invalidate(user_id)
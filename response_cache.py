@@ -0,0 +1,173 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from embedding_cache import normalize_text
+from metrics import record_cache
+from upstream import Deadline, DeadlineExceeded
+
+# Profile fields that construct_prompt uses to shape the system prompt.
+PROMPT_PROFILE_FIELDS = ('tone', 'persona_type', 'persona_key', 'custom_persona', 'explanation_style')
+
+
+def chunk_id(chunk: Dict) -> str:
+    """Stable identifier for a retrieved chunk that survives index rebuilds."""
+    return chunk.get('chunk_hash') or f"{chunk['source']}:{chunk['chunk_index']}"
+
+
+def make_bucket(user_profile: Dict, chunks: List[Dict]) -> str:
+    """Group key for responses that would be produced from the same prompt shape and context."""
+    payload = {
+        'profile': {field: user_profile.get(field) for field in PROMPT_PROFILE_FIELDS},
+        'chunks': [chunk_id(chunk) for chunk in chunks]
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """In-process cache of chat completions with TTL, LRU bounds and request coalescing.
+
+    Entries are grouped by bucket (profile + retrieved chunks). Within a bucket a
+    query hits on its normalized text, or, when similarity_threshold is set, on
+    any cached query whose embedding has cosine similarity above the threshold.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, similarity_threshold: Optional[float] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()  # (bucket, query) -> (expires_at, unit_vector, response)
+        self._buckets: Dict[str, set] = {}
+        self._inflight: Dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, bucket: str, query: str, query_embedding: Optional[List[float]],
+                       compute: Callable[[], str], deadline: Optional[Deadline] = None) -> str:
+        """Return the cached response, or compute it once for all concurrent identical requests.
+
+        Requests that join one already in flight wait for it only until their
+        own deadline, then raise DeadlineExceeded.
+        """
+        key = (bucket, normalize_text(query).casefold())
+        vector = self._unit(query_embedding)
+
+        with self._lock:
+            response = self._lookup(key, vector)
+            if response is not None:
+                self.hits += 1
+                record_cache('response', 1)
+                return response
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+                record_cache('response', 0, 1)
+            else:
+                self.coalesced += 1
+                record_cache('response', 1)  # served without its own completion call
+
+        if not leader:
+            try:
+                return future.result(timeout=None if deadline is None else max(0.0, deadline.remaining()))
+            except TimeoutError:
+                raise DeadlineExceeded("Request deadline passed waiting for an identical request's response")
+
+        try:
+            response = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._store(key, vector, response)
+            del self._inflight[key]
+        future.set_result(response)
+        return response
+
+    def get(self, bucket: str, query: str, query_embedding: Optional[List[float]]) -> Optional[str]:
+        """Return a cached response without computing one on a miss."""
+        with self._lock:
+            response = self._lookup((bucket, normalize_text(query).casefold()), self._unit(query_embedding))
+            if response is not None:
+                self.hits += 1
+                record_cache('response', 1)
+            else:
+                self.misses += 1
+                record_cache('response', 0, 1)
+            return response
+
+    def put(self, bucket: str, query: str, query_embedding: Optional[List[float]], response: str):
+        with self._lock:
+            self._store((bucket, normalize_text(query).casefold()), self._unit(query_embedding), response)
+
+    def _unit(self, embedding: Optional[List[float]]) -> Optional[np.ndarray]:
+        if embedding is None:  # lexical-only retrieval: exact matches only
+            return None
+        vector = np.asarray(embedding, dtype='float32')
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _lookup(self, key: tuple, vector: np.ndarray) -> Optional[str]:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[2]
+            self._remove(key)
+
+        if self.similarity_threshold is None or vector is None:
+            return None
+        best_key, best_score = None, self.similarity_threshold
+        for candidate in list(self._buckets.get(key[0], ())):
+            expires_at, candidate_vector, _ = self._entries[candidate]
+            if expires_at <= now:
+                self._remove(candidate)
+                continue
+            if candidate_vector is None:
+                continue
+            score = float(np.dot(vector, candidate_vector))
+            if score >= best_score:
+                best_key, best_score = candidate, score
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key][2]
+
+    def _store(self, key: tuple, vector: np.ndarray, response: str):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, vector, response)
+        self._entries.move_to_end(key)
+        self._buckets.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple):
+        self._entries.pop(key, None)
+        bucket = self._buckets.get(key[0])
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[key[0]]
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'entries': len(self._entries),
+            'hit_rate': self.hits / total if total else 0.0
+        }
@@ -0,0 +1,145 @@
+"""Post-processing of FAISS candidates before they reach the prompt.
+
+Candidates are over-fetched, exact duplicates (e.g. chunks from the "(1)"
+copies of a guide) are dropped, near-duplicates are filtered while picking a
+diverse set with maximal marginal relevance, and the result is packed into
+a token budget measured with the chat model's tokenizer.
+"""
+import hashlib
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import Config
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """tiktoken encoding for the chat model, or None if it cannot be loaded (e.g. offline)."""
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                try:
+                    _encoding = tiktoken.encoding_for_model(Config.OPENAI_MODEL)
+                except KeyError:
+                    _encoding = tiktoken.get_encoding('cl100k_base')
+            except Exception:
+                _encoding = False
+        return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)  # ~4 characters per token for English text
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def format_excerpt(chunk: Dict) -> str:
+    start, end = chunk.get('start_page'), chunk.get('end_page')
+    if start is None:
+        pages = f"page {chunk['page']}"  # stores ingested before page-aware chunking
+    elif start == end:
+        pages = f"page {start}"
+    else:
+        pages = f"pages {start}-{end}"
+    return f"Excerpt from {chunk['source']}, {pages}: {chunk['text']}"
+
+
+def _dedupe_key(chunk: Dict) -> str:
+    return chunk.get('chunk_hash') or hashlib.sha256(chunk['text'].encode('utf-8')).hexdigest()
+
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int) -> Tuple[List[int], List[float]]:
+    """Merge ranked ID lists into one, scoring each ID by the sum of 1 / (k + rank)."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking, start=1):
+            scores[idx] = scores.get(idx, 0.0) + 1.0 / (k + rank)
+    ids = sorted(scores, key=scores.get, reverse=True)
+    return ids, [scores[idx] for idx in ids]
+
+
+def mmr(query_vector: np.ndarray, candidate_vectors: np.ndarray, k: int,
+        lambda_mult: float, duplicate_threshold: float,
+        relevance: Optional[np.ndarray] = None) -> List[int]:
+    """Indices of up to k candidates chosen by maximal marginal relevance.
+
+    Relevance defaults to cosine similarity with the query; pass scores
+    (scaled to [0, 1]) to rank by something else, such as fused ranks.
+    Candidates whose cosine similarity to an already chosen one reaches
+    duplicate_threshold are treated as near-duplicates and never chosen.
+    """
+    candidates = _unit_rows(candidate_vectors)
+    if relevance is None:
+        relevance = candidates @ _unit_rows(query_vector)
+    similarity = candidates @ candidates.T
+
+    selected: List[int] = []
+    remaining = list(range(len(candidates)))
+    while remaining and len(selected) < k:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+        best = int(np.argmax(scores))
+        choice = remaining.pop(best)
+        if selected and redundancy[best] >= duplicate_threshold:
+            continue
+        selected.append(choice)
+    return selected
+
+
+def pack_to_budget(chunks: Sequence[Dict], budget: int) -> List[Dict]:
+    """Keep chunks in order while their formatted excerpts fit in the token budget."""
+    packed = []
+    used = 0
+    for chunk in chunks:
+        cost = count_tokens(format_excerpt(chunk))
+        if used + cost > budget:
+            continue
+        packed.append(chunk)
+        used += cost
+    return packed
+
+
+def select_context(query_vector: Optional[np.ndarray], ids: Sequence[int], chunks: Sequence[Dict],
+                   vectors: Optional[np.ndarray], scores: Optional[Sequence[float]] = None) -> List[Dict]:
+    """Turn ranked candidates into deduplicated, diverse, budget-packed context.
+
+    scores, when given, are the candidates' fused relevance; without a query
+    vector (lexical-only retrieval) candidates keep their ranked order.
+    """
+    seen = set()
+    unique = []
+    for position, (idx, chunk) in enumerate(zip(ids, chunks)):
+        key = _dedupe_key(chunk)
+        if key not in seen:
+            seen.add(key)
+            unique.append((idx, chunk, scores[position] if scores is not None else None))
+
+    if vectors is not None and query_vector is not None and unique:
+        candidate_vectors = np.asarray(vectors[[idx for idx, _, _ in unique]])
+        relevance = None
+        if scores is not None:
+            relevance = np.array([score for _, _, score in unique], dtype='float32')
+            relevance /= relevance.max()
+        order = mmr(query_vector, candidate_vectors, Config.TOP_K_RESULTS,
+                    Config.MMR_LAMBDA, Config.NEAR_DUPLICATE_THRESHOLD, relevance)
+        selected = [unique[i][1] for i in order]
+    else:
+        selected = [chunk for _, chunk, _ in unique[:Config.TOP_K_RESULTS]]
+
+    return pack_to_budget(selected, Config.CONTEXT_TOKEN_BUDGET)
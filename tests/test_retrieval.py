@@ -0,0 +1,20 @@
+from config import Config
+from retrieval import count_tokens, format_excerpt, pack_to_budget
+
+# Study-guide prose like the densest stored chunks (~1.7 tokens per word with bullets and quotes).
+SAMPLE = ("• Ongoing curriculum change processes in all faculties. The new ‘Towards a Decolonised Science "
+          "in South Africa’ course. UCT was modelled on elitist European universities, in its architecture, "
+          "its organisation into faculties and disciplines, and its ethos.").split()
+
+
+def make_chunk(index: int) -> dict:
+    words = [SAMPLE[i % len(SAMPLE)] for i in range(Config.CHUNK_SIZE)]
+    return {'source': f"SiT_Guide to first year_advance release {index}.pdf", 'start_page': 12, 'end_page': 13,
+            'text': " ".join(words)}
+
+
+def test_default_budget_fits_top_k_full_chunks():
+    chunks = [make_chunk(i) for i in range(Config.TOP_K_RESULTS)]
+    used = sum(count_tokens(format_excerpt(chunk)) for chunk in chunks)
+    assert used <= Config.CONTEXT_TOKEN_BUDGET
+    assert pack_to_budget(chunks, Config.CONTEXT_TOKEN_BUDGET) == chunks
@@ -0,0 +1,196 @@
+"""Deadlines, hedging and circuit breaking for calls to the OpenAI API.
+
+A request gets one ``Deadline`` when it arrives, and every upstream call
+made for it is bounded by whatever time is left, so a slow provider cannot
+hold a worker past REQUEST_DEADLINE_SECONDS. Embedding calls are hedged: if
+the first attempt is still running after the recent p95 (configurable)
+latency, a duplicate is sent and whichever answers first wins. A circuit
+breaker per service fails calls immediately after repeated upstream
+failures, so callers fall back to cached or lexical answers instead of
+queueing behind timeouts. Rate limits and transient errors are retried with
+backoff by ``with_retries``, but only while the deadline leaves room.
+
+Breakers and latency samples are per process (per gunicorn worker).
+"""
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional, TypeVar
+
+import openai
+
+from config import Config
+from metrics import record_upstream
+
+T = TypeVar('T')
+
+# Retries happen in our code, within the request's deadline, not hidden inside the SDK.
+openai.max_retries = Config.OPENAI_MAX_RETRIES
+
+# Errors that say the provider is slow or unhealthy, as opposed to a bad request.
+UPSTREAM_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.InternalServerError,
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request ran out of time before (or while) calling upstream."""
+
+
+class CircuitOpen(RuntimeError):
+    """The upstream service failed repeatedly; calls are refused until the breaker resets."""
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def for_request(cls) -> Optional['Deadline']:
+        """A deadline of REQUEST_DEADLINE_SECONDS from now, or None when disabled."""
+        return cls(Config.REQUEST_DEADLINE_SECONDS) if Config.REQUEST_DEADLINE_SECONDS > 0 else None
+
+    @classmethod
+    def for_batch(cls) -> Optional['Deadline']:
+        """A deadline of BATCH_DEADLINE_SECONDS from now, for one batch of bulk work, or None when disabled."""
+        return cls(Config.BATCH_DEADLINE_SECONDS) if Config.BATCH_DEADLINE_SECONDS > 0 else None
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+def timeout_for(deadline: Optional[Deadline], cap: float) -> float:
+    """Timeout for one upstream call: cap, shortened to the time left on the deadline."""
+    if deadline is None:
+        return cap
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline passed before calling upstream")
+    return min(cap, remaining)
+
+
+def with_retries(function: Callable[[float], T], deadline: Optional[Deadline], cap: float, retries: int) -> T:
+    """Call function(timeout), retrying UPSTREAM_ERRORS with exponential backoff.
+
+    Each attempt gets timeout_for(deadline, cap). A retry is only made if its
+    backoff ends before the deadline does; otherwise the last error is raised.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return function(timeout_for(deadline, cap))
+        except UPSTREAM_ERRORS:
+            pause = min(2 ** attempt, 30) + random.uniform(0, 1)
+            if attempt == retries or (deadline is not None and pause >= deadline.remaining()):
+                raise
+            time.sleep(pause)
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; lets one trial call through after reset_seconds."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> bool:
+        with self._lock:
+            if self.opened_at is None or self.failure_threshold <= 0:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_seconds or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def _record(self, ok: bool):
+        with self._lock:
+            self._trial_running = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failure_threshold > 0 and self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    record_upstream(self.name, 'circuit_open')
+                self.opened_at = time.monotonic()
+
+    def call(self, function: Callable[[], T]) -> T:
+        if not self._acquire():
+            record_upstream(self.name, 'rejected')
+            raise CircuitOpen(f"{self.name} circuit is open after {self.failures} consecutive failures")
+        try:
+            result = function()
+        except UPSTREAM_ERRORS as e:
+            record_upstream(self.name, 'timeout' if isinstance(e, openai.APITimeoutError) else 'error')
+            self._record(False)
+            raise
+        except BaseException:
+            # Our own deadline or a bad request says nothing about the provider's health.
+            with self._lock:
+                self._trial_running = False
+            raise
+        self._record(True)
+        return result
+
+
+class LatencyTracker:
+    """Recent successful call latencies, for picking the hedge delay."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float, min_samples: int = 20) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix='hedge')
+
+
+def hedged(service: str, function: Callable[[], T], delay: Optional[float]) -> T:
+    """Run function; if it hasn't returned after delay seconds, race a second copy against it.
+
+    The first success wins and the loser is left to finish (bounded by its own
+    timeout). If both attempts fail, the last error is raised. delay=None
+    runs a single attempt.
+    """
+    if delay is None:
+        return function()
+    first = _hedge_pool.submit(function)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+    record_upstream(service, 'hedged')
+    pending = {first, _hedge_pool.submit(function)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is not first:
+                    record_upstream(service, 'hedge_won')
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+embedding_breaker = CircuitBreaker('embeddings', Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_SECONDS)
+chat_breaker = CircuitBreaker('chat', Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_SECONDS)
+embedding_latencies = LatencyTracker()
@@ -0,0 +1,139 @@
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from config import Config
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+
+
+def _nlist_for(n: int, nlist: int) -> int:
+    """IVF list count: configured value or ~4*sqrt(n), capped so each list gets enough training points."""
+    nlist = nlist or int(4 * np.sqrt(n))
+    return max(1, min(nlist, n // 39))
+
+
+def _pq_m_for(dimension: int, m: int) -> int:
+    """Largest sub-quantizer count <= m that divides the dimension."""
+    for candidate in range(min(m, dimension), 0, -1):
+        if dimension % candidate == 0:
+            return candidate
+    return 1
+
+
+def index_info(index_type: str = None) -> Dict:
+    """The index type and the build parameters that apply to it, as recorded in the manifest."""
+    index_type = index_type or Config.FAISS_INDEX_TYPE
+    info = {'index_type': index_type}
+    if index_type == 'hnsw':
+        info.update(hnsw_m=Config.FAISS_HNSW_M, ef_construction=Config.FAISS_HNSW_EF_CONSTRUCTION)
+    elif index_type in ('ivf_flat', 'ivf_pq'):
+        info.update(nlist=Config.FAISS_NLIST, train_sample=Config.FAISS_TRAIN_SAMPLE)
+        if index_type == 'ivf_pq':
+            info.update(pq_m=Config.FAISS_PQ_M, pq_nbits=Config.FAISS_PQ_NBITS)
+    return info
+
+
+def build_index(vectors: np.ndarray, index_type: str = None, ids: Optional[np.ndarray] = None) -> faiss.Index:
+    """Build a FAISS index of the configured type, training it on a sample when needed.
+
+    With ids, the index is wrapped in an IndexIDMap and searches return those IDs.
+    """
+    index_type = index_type or Config.FAISS_INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type {index_type!r}; expected one of {INDEX_TYPES}")
+
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    n, dimension = vectors.shape
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, Config.FAISS_HNSW_M)
+        index.hnsw.efConstruction = Config.FAISS_HNSW_EF_CONSTRUCTION
+    else:
+        nlist = _nlist_for(n, Config.FAISS_NLIST)
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        else:
+            # Each of the 2**nbits PQ centroids needs ~39 training points.
+            nbits = max(1, min(Config.FAISS_PQ_NBITS, int(np.log2(max(n // 39, 2)))))
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, _pq_m_for(dimension, Config.FAISS_PQ_M), nbits)
+
+    if not index.is_trained:
+        sample_size = min(n, Config.FAISS_TRAIN_SAMPLE)
+        sample = vectors[np.random.default_rng(0).choice(n, sample_size, replace=False)]
+        index.train(sample)
+    if ids is not None:
+        index = faiss.IndexIDMap(index)
+        index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype='int64'))
+    else:
+        index.add(vectors)
+    configure_search(index)
+    return index
+
+
+def read_index(path: str, mmap: bool = None) -> faiss.Index:
+    """Load an index, memory-mapping it read-only when Config.FAISS_MMAP is set."""
+    if not (Config.FAISS_MMAP if mmap is None else mmap):
+        return faiss.read_index(path)
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    # IO_FLAG_MMAP_IFC also maps flat codes in place, but not every index type supports it.
+    mmap_ifc = getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+    if mmap_ifc:
+        try:
+            return faiss.read_index(path, flags | mmap_ifc)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path, flags)
+
+
+def configure_search(index: faiss.Index, nprobe: int = None, ef_search: int = None) -> faiss.Index:
+    """Apply query-time knobs (nprobe for IVF, efSearch for HNSW) to a loaded index."""
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe or Config.FAISS_NPROBE
+    except RuntimeError:
+        pass
+    hnsw_index = _base_index(index)
+    if hasattr(hnsw_index, 'hnsw'):
+        hnsw_index.hnsw.efSearch = ef_search or Config.FAISS_EF_SEARCH
+    return index
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    """The index an IndexIDMap wraps (or the index itself), downcast to its concrete type."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def id_selector(ranges: List[Tuple[int, int]]) -> faiss.IDSelector:
+    """Selector accepting IDs in any of the [start, end) ranges."""
+    parts = [faiss.IDSelectorRange(start, end) for start, end in ranges]
+    selector = parts[0]
+    for part in parts[1:]:
+        selector = faiss.IDSelectorOr(selector, part)
+        parts.append(selector)
+    selector.referenced_objects = parts  # the C++ selectors only hold raw pointers to each other
+    return selector
+
+
+def search_params(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """Search parameters restricting index to selector, keeping the configured nprobe/efSearch."""
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    elif isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    params.referenced_objects = [selector]
+    return params
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """Serialized size of the index, a close proxy for its resident memory."""
+    return int(faiss.serialize_index(index).nbytes)